@@ -0,0 +1,262 @@
+"""
+Rule-based alert engine for the volume meter
+"""
+import time
+from stats import EnergyWindow
+
+
+def _local_hour():
+    """Return the current local hour (0-23) from the RTC."""
+    return time.localtime()[3]
+
+
+class AlertRule:
+    """
+    Declarative description of one alert condition.
+
+    Examples:
+        AlertRule("peak", threshold=85)
+            Any single sample over 85 dB.
+        AlertRule("leq", threshold=65, metric=AlertRule.LEQ, window_s=30)
+            Equivalent continuous level over the last 30 s above 65 dB.
+        AlertRule("night", threshold=55, sustain_s=10, hours=(22, 7))
+            Over 55 dB for 10 s, only between 22:00 and 07:00.
+    """
+
+    # Metrics
+    LEVEL = "level"  # the instantaneous reading
+    LEQ = "leq"      # energy average over window_s
+
+    def __init__(self, name, threshold, metric=LEVEL, window_s=0, sustain_s=0,
+                 hysteresis=3, cooldown_s=90, channels=("push",), hours=None,
+                 title=None):
+        """
+        Initialize the rule.
+
+        Args:
+            name: Short identifier, used in alert messages
+            threshold: Level in dB the metric has to exceed to trigger
+            metric: AlertRule.LEVEL or AlertRule.LEQ
+            window_s: Averaging window in seconds (LEQ only)
+            sustain_s: Seconds the metric has to stay above threshold before firing
+            hysteresis: dB below threshold the metric has to drop to re-arm the rule
+            cooldown_s: Minimum seconds between two alerts on the same channel
+            channels: Names of the channels an alert is sent to
+            hours: Optional (start, end) local hours the rule is active in,
+                wrapping past midnight when start > end
+            title: Notification title, defaults to "Noise Alert"
+        """
+        if metric not in (self.LEVEL, self.LEQ):
+            raise ValueError(f"Unknown alert metric: {metric}")
+        if metric == self.LEQ and window_s <= 0:
+            raise ValueError("LEQ rules need a window_s > 0")
+        self.name = name
+        self.threshold = threshold
+        self.metric = metric
+        self.window_s = window_s
+        self.sustain_s = sustain_s
+        self.hysteresis = hysteresis
+        self.cooldown_s = cooldown_s
+        self.channels = tuple(channels)
+        self.hours = hours
+        self.title = title or "Noise Alert"
+
+    def in_schedule(self, hour):
+        """Whether the rule is active at the given local hour, None if unknown."""
+        if self.hours is None:
+            return True
+        if hour is None:
+            # Without a known time a scheduled rule stays off
+            return False
+        start, end = self.hours
+        if start <= end:
+            return start <= hour < end
+        return hour >= start or hour < end
+
+    def message(self, value):
+        """Notification body for an alert raised at the given metric value."""
+        if self.metric == self.LEQ:
+            return f"Average level over {self.window_s}s was {value:.0f}db ({self.name})"
+        return f"You are being too loud: {value:.0f}db ({self.name})"
+
+
+class _RuleState:
+    """
+    Incremental evaluation state of a single rule.
+    """
+
+    def __init__(self, rule, period_ms):
+        self.rule = rule
+        self.sustain_samples = max(1, -(-rule.sustain_s * 1000 // period_ms))
+        self.cooldown_samples = rule.cooldown_s * 1000 // period_ms
+        self.above = 0
+        self.active = False
+        # Sample index each channel last fired at
+        self.last_fired = [-self.cooldown_samples - 1] * len(rule.channels)
+        # Whether each channel has fired since the rule became active
+        self.notified = [False] * len(rule.channels)
+
+        # Sample energies for LEQ rules
+        if rule.metric == AlertRule.LEQ:
+            self.window = EnergyWindow(max(1, rule.window_s * 1000 // period_ms))
+        else:
+            self.window = None
+
+    def value(self, level):
+        """Push a sample and return the rule's metric, or None while not defined."""
+        if self.window is None:
+            return level
+        self.window.add(level)
+        if self.window.filled < self.window.size:
+            return None
+        return self.window.leq
+
+    def reset(self):
+        self.above = 0
+        self.active = False
+        for i in range(len(self.notified)):
+            self.notified[i] = False
+
+
+class AlertEngine:
+    """
+    Evaluates a list of AlertRule against the sample stream, one sample at a time.
+
+    Each call to feed() costs O(len(rules)), independent of window lengths.
+    """
+
+    def __init__(self, rules, period_ms=500, clock=None):
+        """
+        Initialize the engine.
+
+        Args:
+            rules: List of AlertRule to evaluate
+            period_ms: Sampling period the engine is fed at
+            clock: Callable returning the local hour, used by scheduled rules.
+                It may return None while the time is unknown, which keeps
+                scheduled rules inactive.
+        """
+        self.rules = rules
+        self.period_ms = period_ms
+        self.clock = clock or _local_hour
+        self.sample_index = 0
+        self._states = [_RuleState(rule, period_ms) for rule in rules]
+        self._scheduled = any(rule.hours is not None for rule in rules)
+
+    def feed(self, level):
+        """
+        Evaluate all rules against a new sample.
+
+        Args:
+            level: Sound level in dB, or None for a missing sample
+
+        Returns:
+            List of (rule, channel, value) for every alert to send
+        """
+        alerts = []
+        if level is None:
+            # A missing sample neither arms nor clears any rule
+            self.sample_index += 1
+            return alerts
+
+        hour = self.clock() if self._scheduled else 0
+        index = self.sample_index
+        for state in self._states:
+            rule = state.rule
+            value = state.value(level)
+            if value is None:
+                continue
+            if not rule.in_schedule(hour):
+                state.reset()
+                continue
+
+            if state.active:
+                if value <= rule.threshold - rule.hysteresis:
+                    state.reset()
+                    continue
+                if value <= rule.threshold:
+                    continue
+            else:
+                if value > rule.threshold:
+                    state.above += 1
+                else:
+                    state.above = 0
+                if state.above < state.sustain_samples:
+                    continue
+                state.active = True
+
+            # A channel still in cooldown fires once it ends, if the rule is
+            # still above threshold then
+            for i, channel in enumerate(rule.channels):
+                if not state.notified[i] and index - state.last_fired[i] > state.cooldown_samples:
+                    state.last_fired[i] = index
+                    state.notified[i] = True
+                    alerts.append((rule, channel, value))
+
+        self.sample_index += 1
+        return alerts
+
+
+def replay(engine, levels):
+    """
+    Feed a recorded trace through an engine.
+
+    Args:
+        engine: AlertEngine to feed
+        levels: Iterable of dB samples (None for missing samples)
+
+    Returns:
+        List of (sample_index, rule, channel, value) for every alert raised
+    """
+    fired = []
+    for level in levels:
+        index = engine.sample_index
+        for rule, channel, value in engine.feed(level):
+            fired.append((index, rule, channel, value))
+    return fired
+
+
+###############################################
+# Main
+if __name__ == "__main__":
+    import random
+
+    # Synthetic 2 hour trace at 500 ms: background chatter with door slams
+    # (isolated spikes) and a handful of genuine disturbances lasting 20-120 s
+    random.seed(26)
+    PERIOD_MS = 500
+    trace = [max(30, min(120, int(random.gauss(52, 4)))) for _ in range(14400)]
+    for _ in range(60):
+        trace[random.randrange(len(trace))] = random.randint(72, 85)
+    events = []
+    for start in range(1200, 14400, 2400):
+        length = random.randint(60, 240)
+        base = random.choice((67, 72, 78))
+        for i in range(start, min(len(trace), start + length)):
+            trace[i] = max(trace[i], int(random.gauss(base, 2)))
+        events.append((start, start + length))
+
+    def score(name, rules):
+        engine = AlertEngine(rules, period_ms=PERIOD_MS, clock=lambda: 12)
+        fired = replay(engine, trace)
+        grace = 10 * 1000 // PERIOD_MS
+        true_pos = [f for f in fired if any(s <= f[0] <= e + grace for s, e in events)]
+        detected = sum(1 for s, e in events if any(s <= f[0] <= e + grace for f in fired))
+        false_pos = len(fired) - len(true_pos)
+        rate = false_pos / len(fired) if fired else 0.0
+        print(f"{name:>8}: {len(fired):3d} alerts, {false_pos:3d} false positives "
+              f"({rate:.0%}), {detected}/{len(events)} events detected")
+
+    # Approximates the previous hard-coded `sound_level > 70` with a 90 s cooldown
+    score("legacy", [AlertRule("legacy", threshold=70, hysteresis=0)])
+    score("rules", [
+        AlertRule("loud", threshold=70, sustain_s=5, hysteresis=5),
+        AlertRule("leq", threshold=65, metric=AlertRule.LEQ, window_s=60, cooldown_s=300),
+    ])
+
+    # Noise that resumes after a short dip while the rule is cooling down is
+    # reported once the cooldown ends, and only once
+    loud = AlertRule("loud", threshold=70, sustain_s=1, hysteresis=5, cooldown_s=90)
+    engine = AlertEngine([loud], period_ms=PERIOD_MS, clock=lambda: 12)
+    fired = replay(engine, [75] * 20 + [60] * 10 + [75] * 1200)
+    assert [index for index, _, _, _ in fired] == [1, 182], fired
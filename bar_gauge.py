@@ -32,9 +32,28 @@ class BarGauge:
             fill_percent: Fill percentage (0.0 to 1.0)
             color: Color for the bar fill
         """
-        # Draw background bar outline (empty rectangle)
-        self.lcd.rect(self.x, self.y, self.bar_width, self.bar_height, self.lcd.black)
+        self.draw_outline()
+        self.draw_fill(fill_percent, color)
 
+    def draw_outline(self, color=None):
+        """
+        Draw the static bar outline (empty rectangle).
+
+        Args:
+            color: Outline color, black by default
+        """
+        if color is None:
+            color = self.lcd.black
+        self.lcd.rect(self.x, self.y, self.bar_width, self.bar_height, color)
+
+    def draw_fill(self, fill_percent, color):
+        """
+        Draw only the filled portion inside the outline.
+
+        Args:
+            fill_percent: Fill percentage (0.0 to 1.0)
+            color: Color for the bar fill
+        """
         # Calculate and draw filled portion
         fill_width = int(self.bar_width * fill_percent)
         if fill_width > 1:
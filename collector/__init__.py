@@ -0,0 +1,9 @@
+"""
+Fleet collector for the volume meters
+
+Runs on a server under CPython with NumPy, not on the Pico. Meters upload
+sample batches over HTTP (see collector.server); samples are kept in a
+columnar, memory-mapped store (collector.store) and aggregated with
+vectorized queries (collector.queries).
+"""
+from collector.store import ColumnStore
@@ -0,0 +1,97 @@
+"""
+Ingest and query benchmark on a synthetic fleet
+
+    python -m collector.bench --meters 500 --days 30
+"""
+import argparse
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+from collector import queries
+from collector.store import ColumnStore, HOUR_MS
+
+DAY_MS = 24 * HOUR_MS
+
+
+def synthetic_day(rng, day_start_ms, period_ms):
+    """
+    One day of samples for one meter: a diurnal curve plus noise and bursts.
+
+    Returns:
+        (timestamps_ms, levels)
+    """
+    timestamps = day_start_ms + np.arange(0, DAY_MS, period_ms, dtype=np.int64)
+    hour_of_day = (timestamps % DAY_MS) / HOUR_MS
+    levels = 45 + 12 * np.clip(np.sin((hour_of_day - 7) / 14 * np.pi), 0, None)
+    levels += rng.normal(0, 4, len(timestamps))
+    bursts = rng.random(len(timestamps)) < 0.01
+    levels[bursts] += rng.uniform(10, 35, bursts.sum())
+    return timestamps, np.clip(levels, 30, 120).astype(np.uint8)
+
+
+def disk_usage(root):
+    return sum(path.stat().st_blocks * 512 for path in Path(root).rglob("*") if path.is_file())
+
+
+def run(root, meters, days, period_ms, rooms, seed=31):
+    rng = np.random.default_rng(seed)
+    store = ColumnStore(root)
+    start_ms = int(time.time() * 1000) // DAY_MS * DAY_MS - days * DAY_MS
+    end_ms = start_ms + days * DAY_MS
+
+    # Ingest: one batch per meter and day, like a daily upload
+    samples = 0
+    started = time.perf_counter()
+    for day in range(days):
+        for meter in range(meters):
+            timestamps, levels = synthetic_day(rng, start_ms + day * DAY_MS, period_ms)
+            samples += store.append(f"meter{meter:04d}", timestamps, levels,
+                                    room=f"room{meter % rooms:03d}")
+    elapsed = time.perf_counter() - started
+    print(f"ingest: {samples:,} samples from {meters} meters over {days} days "
+          f"in {elapsed:.1f}s ({samples / elapsed:,.0f} samples/s)")
+    print(f"disk: {disk_usage(root) / 1e6:.1f} MB")
+
+    def timed(name, query, repeat=3):
+        # Peak from a traced run of its own, so tracing doesn't skew the timing
+        tracemalloc.start()
+        query()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = query()
+            duration = time.perf_counter() - started
+            best = duration if best is None else min(best, duration)
+        print(f"{name}: {best * 1000:.0f} ms, peak {peak / 1e6:.1f} MB")
+        return result
+
+    last_day = end_ms - DAY_MS
+    timed("leq per room per hour, last day", lambda: queries.leq_per_hour(store, last_day, end_ms))
+    timed("leq per room per hour, whole range", lambda: queries.leq_per_hour(store, start_ms, end_ms))
+    top = timed("top 10 loudest device-hours", lambda: queries.top_loudest(store, start_ms, end_ms, 10))
+    timed("L90/L50/L10 map per room", lambda: queries.percentile_map(store, start_ms, end_ms))
+    name, hour, level = top[0]
+    print(f"loudest: {name} at hour {hour // HOUR_MS} with {level:.1f} dB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collector ingest and query benchmark")
+    parser.add_argument("--meters", type=int, default=500)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--period-ms", type=int, default=60_000,
+                        help="sample period of the uploads (default one per minute)")
+    parser.add_argument("--rooms", type=int, default=50)
+    parser.add_argument("--root", help="store directory (default: a temporary one)")
+    args = parser.parse_args()
+
+    if args.root:
+        run(args.root, args.meters, args.days, args.period_ms, args.rooms)
+    else:
+        with tempfile.TemporaryDirectory() as root:
+            run(root, args.meters, args.days, args.period_ms, args.rooms)
@@ -0,0 +1,161 @@
+"""
+Vectorized aggregate queries over a ColumnStore
+"""
+import numpy as np
+
+from collector.store import ENERGY, HOUR_MS
+
+
+def _groups(store, by):
+    """
+    Map devices to result rows.
+
+    Returns:
+        (row names, list of the devices in each row)
+    """
+    devices = store.devices
+    if by == "device":
+        return devices, [[device] for device in devices]
+    if by == "room":
+        # Devices without a room form a group of their own
+        groups = {}
+        for device in devices:
+            groups.setdefault(store.rooms.get(device, device), []).append(device)
+        names = sorted(groups)
+        return names, [groups[name] for name in names]
+    raise ValueError(f"Unknown grouping: {by}")
+
+
+def _hours(start_ms, end_ms):
+    """(first hour, end hour, hour start epoch ms array) covering a range"""
+    start_hour = start_ms // HOUR_MS
+    end_hour = -(-end_ms // HOUR_MS)
+    return start_hour, end_hour, np.arange(start_hour, end_hour, dtype=np.int64) * HOUR_MS
+
+
+def _group_histograms(store, members, start_hour, end_hour):
+    """
+    Per hour dB histograms of each group in turn, so only one group's
+    histograms are held at a time.
+
+    Yields:
+        uint32 array of shape (end_hour - start_hour, 256) per group
+    """
+    for devices in members:
+        histograms = store.histograms(devices[0], start_hour, end_hour)
+        for device in devices[1:]:
+            histograms += store.histograms(device, start_hour, end_hour)
+        yield histograms
+
+
+def hourly_histograms(store, start_ms, end_ms, by="room"):
+    """
+    dB histograms per group and hour.
+
+    The result holds every group at once; leq_per_hour() and
+    percentile_map() reduce one group at a time instead.
+
+    Args:
+        store: ColumnStore to query
+        start_ms: Start of the range in epoch ms, inclusive
+        end_ms: End of the range in epoch ms, exclusive
+        by: "room" or "device"
+
+    Returns:
+        (names, hour start epoch ms array, uint32 array of shape
+        (len(names), hours, 256))
+    """
+    start_hour, end_hour, hours = _hours(start_ms, end_ms)
+    names, members = _groups(store, by)
+    result = np.zeros((len(names), len(hours), 256), dtype=np.uint32)
+    for row, histograms in enumerate(_group_histograms(store, members, start_hour, end_hour)):
+        result[row] = histograms
+    return names, hours, result
+
+
+def leq(histograms):
+    """
+    Equivalent continuous level of each histogram.
+
+    Args:
+        histograms: Array of shape (..., 256)
+
+    Returns:
+        float array of shape (...), NaN where there are no samples
+    """
+    counts = histograms.sum(axis=-1, dtype=np.float64)
+    energy = histograms @ ENERGY
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(counts > 0, 10 * np.log10(energy / counts), np.nan)
+
+
+def percentiles(histograms, q):
+    """
+    Percentile levels of each histogram.
+
+    Args:
+        histograms: Array of shape (..., 256)
+        q: Sequence of percentiles in 0-100; q=10 is the level 10% of the
+            samples are at or below, i.e. the acoustic L90
+
+    Returns:
+        float array of shape (..., len(q)), NaN where there are no samples
+    """
+    cumulative = np.cumsum(histograms, axis=-1, dtype=np.int64)
+    totals = cumulative[..., -1]
+    levels = np.empty(totals.shape + (len(q),))
+    for i, percentile in enumerate(q):
+        # First level whose cumulative count reaches the target
+        targets = totals * (percentile / 100)
+        levels[..., i] = np.count_nonzero(cumulative < targets[..., None], axis=-1)
+    levels[totals == 0] = np.nan
+    return levels
+
+
+def leq_per_hour(store, start_ms, end_ms, by="room"):
+    """
+    Leq per group and hour.
+
+    Returns:
+        (names, hour start epoch ms array, float array (len(names), hours))
+    """
+    start_hour, end_hour, hours = _hours(start_ms, end_ms)
+    names, members = _groups(store, by)
+    levels = np.empty((len(names), len(hours)))
+    for row, histograms in enumerate(_group_histograms(store, members, start_hour, end_hour)):
+        levels[row] = leq(histograms)
+    return names, hours, levels
+
+
+def top_loudest(store, start_ms, end_ms, n=10, by="device"):
+    """
+    The n loudest group-hours by Leq.
+
+    Returns:
+        List of (name, hour start epoch ms, leq), loudest first
+    """
+    names, hours, levels = leq_per_hour(store, start_ms, end_ms, by)
+    flat = np.nan_to_num(levels, nan=-np.inf).ravel()
+    n = min(n, np.isfinite(flat).sum())
+    if not n:
+        return []
+    top = np.argpartition(flat, -n)[-n:]
+    top = top[np.argsort(flat[top])[::-1]]
+    rows, columns = np.unravel_index(top, levels.shape)
+    return [(names[row], int(hours[column]), float(levels[row, column]))
+            for row, column in zip(rows, columns)]
+
+
+def percentile_map(store, start_ms, end_ms, q=(10, 50, 90), by="room"):
+    """
+    Percentile levels (e.g. L10/L50/L90) per group and hour.
+
+    Returns:
+        (names, hour start epoch ms array, float array (len(names), hours, len(q)))
+    """
+    start_hour, end_hour, hours = _hours(start_ms, end_ms)
+    names, members = _groups(store, by)
+    levels = np.empty((len(names), len(hours), len(q)))
+    for row, histograms in enumerate(_group_histograms(store, members, start_hour, end_hour)):
+        levels[row] = percentiles(histograms, q)
+    return names, hours, levels
@@ -0,0 +1,123 @@
+"""
+HTTP front end of the fleet collector
+
+    POST /ingest       one batch or a list of batches, JSON:
+                       {"device": "...", "room": "...", "base_ms": epoch ms,
+                        "offsets_ms": [...], "db": [...]}
+    GET  /leq          ?start=&end=&by=room|device
+    GET  /top          ?start=&end=&n=10&by=device|room
+    GET  /percentiles  ?start=&end=&q=10,50,90&by=room|device
+
+start and end are epoch milliseconds, end defaulting to now and start to
+24 hours before end.
+
+    python -m collector.server --root data --port 8000
+"""
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from collector import queries
+from collector.store import ColumnStore, HOUR_MS
+
+
+def ingest(store, batches):
+    """
+    Store uploaded batches.
+
+    Args:
+        store: ColumnStore to append to
+        batches: One batch dict or a list of them
+
+    Returns:
+        Number of samples stored
+    """
+    if isinstance(batches, dict):
+        batches = [batches]
+    stored = 0
+    for batch in batches:
+        timestamps = batch["base_ms"] + np.asarray(batch["offsets_ms"], dtype=np.int64)
+        stored += store.append(batch["device"], timestamps, batch["db"], room=batch.get("room"))
+    return stored
+
+
+def _rows(values):
+    """Nested lists with NaN replaced by None, for JSON"""
+    return np.where(np.isnan(values), None, np.round(values, 1)).tolist()
+
+
+class CollectorHandler(BaseHTTPRequestHandler):
+    store = None  # set by serve()
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/ingest":
+            self._reply(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            stored = ingest(self.store, json.loads(self.rfile.read(length)))
+        except (KeyError, TypeError, ValueError) as e:
+            self._reply(400, {"error": str(e)})
+            return
+        self._reply(200, {"stored": stored})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            end = int(params.get("end", time.time() * 1000))
+            start = int(params.get("start", end - 24 * HOUR_MS))
+            if url.path == "/leq":
+                names, hours, levels = queries.leq_per_hour(
+                    self.store, start, end, params.get("by", "room"))
+                payload = {"names": names, "hours": hours.tolist(), "leq": _rows(levels)}
+            elif url.path == "/top":
+                payload = {"top": queries.top_loudest(
+                    self.store, start, end, int(params.get("n", 10)), params.get("by", "device"))}
+            elif url.path == "/percentiles":
+                q = [float(value) for value in params.get("q", "10,50,90").split(",")]
+                names, hours, levels = queries.percentile_map(
+                    self.store, start, end, q, params.get("by", "room"))
+                payload = {"names": names, "hours": hours.tolist(), "q": q,
+                           "levels": _rows(levels)}
+            else:
+                self._reply(404, {"error": "not found"})
+                return
+        except ValueError as e:
+            self._reply(400, {"error": str(e)})
+            return
+        self._reply(200, payload)
+
+
+def serve(root, host="0.0.0.0", port=8000):
+    """Run the collector until interrupted"""
+    CollectorHandler.store = ColumnStore(root)
+    server = ThreadingHTTPServer((host, port), CollectorHandler)
+    print(f"Collector serving {root} on {host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--root", default="data", help="store directory")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    serve(args.root, args.host, args.port)
@@ -0,0 +1,180 @@
+"""
+Columnar, memory-mapped sample store partitioned by device and hour
+"""
+import json
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+HOUR_MS = 3_600_000
+# Hour rows in a monthly rollup, enough for 31 days
+MONTH_HOURS = 744
+
+# Relative sound energy per integer dB level
+ENERGY = 10.0 ** (np.arange(256) / 10)
+
+
+def _month_of(hour):
+    """(year, month) of an absolute hour since the epoch, in UTC"""
+    moment = datetime.fromtimestamp(hour * 3600, tz=timezone.utc)
+    return moment.year, moment.month
+
+
+def _month_start_hour(year, month):
+    return int(datetime(year, month, 1, tzinfo=timezone.utc).timestamp()) // 3600
+
+
+class ColumnStore:
+    """
+    Stores samples column-wise on disk:
+
+        <root>/rooms.json                   device -> room
+        <root>/<device>/<YYYYMMDDHH>/ts.u4  ms offset into the hour (uint32)
+        <root>/<device>/<YYYYMMDDHH>/db.u1  level in dB (uint8)
+        <root>/<device>/<YYYYMM>.hist       per hour dB histogram (744 x 256 uint32)
+
+    Raw columns are appended in place and read back with np.memmap. The
+    monthly histogram rollups are updated on ingest, so aggregate queries
+    read one small memmap per device and month instead of every partition.
+    """
+
+    def __init__(self, root):
+        """
+        Open or create a store.
+
+        Args:
+            root: Directory holding the store
+        """
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._rooms_path = self.root / "rooms.json"
+        self.rooms = json.loads(self._rooms_path.read_text()) if self._rooms_path.exists() else {}
+        self._lock = threading.Lock()
+
+    ###############################################
+    # Ingest
+
+    def append(self, device, timestamps_ms, levels, room=None):
+        """
+        Append a batch of samples of one device.
+
+        Args:
+            device: Device identifier, used as directory name
+            timestamps_ms: Epoch milliseconds per sample
+            levels: dB level per sample
+            room: Optional room the device is in
+
+        Returns:
+            Number of samples stored
+        """
+        if not device or "/" in device or device.startswith("."):
+            raise ValueError(f"Invalid device name: {device!r}")
+        ts = np.asarray(timestamps_ms, dtype=np.int64)
+        db = np.clip(np.asarray(levels), 0, 255).astype(np.uint8)
+        if ts.shape != db.shape:
+            raise ValueError("timestamps and levels differ in length")
+        if not len(ts):
+            return 0
+        if np.any(ts[1:] < ts[:-1]):
+            order = np.argsort(ts, kind="stable")
+            ts, db = ts[order], db[order]
+
+        hours = ts // HOUR_MS
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(hours)) + 1))
+        ends = np.append(starts[1:], len(ts))
+
+        with self._lock:
+            if room is not None and self.rooms.get(device) != room:
+                self.rooms[device] = room
+                self._rooms_path.write_text(json.dumps(self.rooms))
+
+            device_dir = self.root / device
+            for start, end in zip(starts, ends):
+                hour = int(hours[start])
+                partition = device_dir / datetime.fromtimestamp(
+                    hour * 3600, tz=timezone.utc).strftime("%Y%m%d%H")
+                partition.mkdir(parents=True, exist_ok=True)
+                with open(partition / "ts.u4", "ab") as file:
+                    file.write((ts[start:end] - hour * HOUR_MS).astype("<u4").tobytes())
+                with open(partition / "db.u1", "ab") as file:
+                    file.write(db[start:end].tobytes())
+
+            # Rollups, grouped by month
+            months = {}
+            for hour in np.unique(hours):
+                months.setdefault(_month_of(int(hour)), []).append(int(hour))
+            for (year, month), month_hours in months.items():
+                base = _month_start_hour(year, month)
+                mask = (hours >= month_hours[0]) & (hours <= month_hours[-1])
+                keys = (hours[mask] - base) * 256 + db[mask]
+                bins, counts = np.unique(keys, return_counts=True)
+                rollup = self._rollup(device, year, month, create=True)
+                rollup.reshape(-1)[bins] += counts.astype(np.uint32)
+                rollup.flush()
+        return len(ts)
+
+    ###############################################
+    # Reading
+
+    def _rollup(self, device, year, month, create=False):
+        path = self.root / device / f"{year:04d}{month:02d}.hist"
+        if not path.exists():
+            if not create:
+                return None
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "wb") as file:
+                file.truncate(MONTH_HOURS * 256 * 4)  # sparse until written
+        return np.memmap(path, dtype="<u4", mode="r+" if create else "r",
+                         shape=(MONTH_HOURS, 256))
+
+    @property
+    def devices(self):
+        """Sorted identifiers of all devices with data"""
+        return sorted(path.name for path in self.root.iterdir() if path.is_dir())
+
+    def samples(self, device, hour):
+        """
+        Raw samples of one partition.
+
+        Args:
+            device: Device identifier
+            hour: Absolute hour since the epoch (epoch ms // HOUR_MS)
+
+        Returns:
+            (timestamps_ms int64 array, levels uint8 memmap), empty if missing
+        """
+        partition = self.root / device / datetime.fromtimestamp(
+            hour * 3600, tz=timezone.utc).strftime("%Y%m%d%H")
+        db_path = partition / "db.u1"
+        if not db_path.exists() or not db_path.stat().st_size:
+            return np.empty(0, np.int64), np.empty(0, np.uint8)
+        offsets = np.memmap(partition / "ts.u4", dtype="<u4", mode="r")
+        levels = np.memmap(db_path, dtype=np.uint8, mode="r")
+        return offsets.astype(np.int64) + hour * HOUR_MS, levels
+
+    def histograms(self, device, start_hour, end_hour):
+        """
+        Per hour dB histograms of one device.
+
+        Args:
+            device: Device identifier
+            start_hour: First absolute hour, inclusive
+            end_hour: Last absolute hour, exclusive
+
+        Returns:
+            uint32 array of shape (end_hour - start_hour, 256)
+        """
+        result = np.zeros((end_hour - start_hour, 256), dtype=np.uint32)
+        hour = start_hour
+        while hour < end_hour:
+            year, month = _month_of(hour)
+            base = _month_start_hour(year, month)
+            next_month = _month_start_hour(year + month // 12, month % 12 + 1)
+            stop = min(end_hour, next_month)
+            rollup = self._rollup(device, year, month)
+            if rollup is not None:
+                result[hour - start_hour:stop - start_hour] = rollup[hour - base:stop - base]
+            hour = stop
+        return result
@@ -1,8 +1,8 @@
-import machine
 import utime
 import urequests
 import sys
 import ujson
+from i2c_bus import I2CBus
 
 class DBMeter():
 
@@ -38,11 +38,17 @@ class DBMeter():
 
     def __init__(self):
         # Initialize I2C with pins
-        # Using I2C1 bus with GP2 (SDA) and GP3 (SCL)
-        self.i2c = machine.I2C(1,
-                        scl=machine.Pin(3),
-                        sda=machine.Pin(2),
-                        freq=100000)
+        # Using I2C1 bus with GP2 (SDA) and GP3 (SCL), at the fastest
+        # frequency the sensor reads reliably at, recovering if it gets stuck
+        self.i2c = I2CBus(1,
+                        scl=3,
+                        sda=2,
+                        address=self.PCBARTISTS_DBM,
+                        probe_reg=self.I2C_REG_VERSION)
+        self.i2c.tune()
+
+        # Optional sensor_trace.TraceRecorder capturing every register read
+        self.recorder = None
 
     ###############################################
     # Functions
@@ -70,7 +76,15 @@ class DBMeter():
             return bytearray()
         
         # Request data from specified register(s) over I2C
-        data = self.i2c.readfrom_mem(addr, reg, nbytes)
+        try:
+            data = self.i2c.readfrom_mem(addr, reg, nbytes)
+        except Exception:
+            if self.recorder:
+                self.recorder.record_failure(reg)
+            raise
+
+        if self.recorder:
+            self.recorder.record(reg, data)
         
         return data
     
@@ -79,7 +93,7 @@ class DBMeter():
         """
         Read the current sound level in decibels (dB SPL) from the meter.
 
-        :return: Current sound level as integer
+        :return: Current sound level as integer, None if the read failed
         """
         try:
             data = self.reg_read(self.PCBARTISTS_DBM, self.I2C_REG_DECIBEL)
@@ -87,7 +101,7 @@ class DBMeter():
             return self._decibel_value
         except Exception as e:
             print(f"DBMeter Error - Failed to read I2C register: {type(e).__name__}: {e}")
-            return 0
+            return None
         
     @property
     def notification_cooldown(self):
@@ -103,7 +117,7 @@ class DBMeter():
         return time_since_last_cooldown > self.NOTIFICATION_COOLDOWN
 
     
-    def notify(self,body = None, title = None):
+    def notify(self,body = None, title = None, check_cooldown = True):
         """
         data = f"You are being too loud: {self._decibel_value}db".encode("utf-8")
         headers = {
@@ -115,7 +129,8 @@ class DBMeter():
         urequests.post("https://ntfy.oss.house/volume_alerts", data=data, headers=headers)
         """
         try:
-            assert self.notification_cooldown, "Cooldown period is not over"
+            # Callers with their own rate limiting (see alerts.AlertEngine) skip the shared cooldown
+            assert not check_cooldown or self.notification_cooldown, "Cooldown period is not over"
             response = urequests.post(
                 url="http://ntfy.oss.house/push",
                 headers={
@@ -166,6 +181,9 @@ if __name__=="__main__":
 
     while True:
         sound_level = db_meter.current_decibel
-        print("Sound Level (dB SPL) = {:02d}".format(sound_level))
+        if sound_level is None:
+            print("Sound Level (dB SPL) = --")
+        else:
+            print("Sound Level (dB SPL) = {:02d}".format(sound_level))
         utime.sleep (2)
     sys.exit()
\ No newline at end of file
@@ -0,0 +1,255 @@
+"""
+Compact in-RAM history of dB samples
+"""
+from array import array
+
+# Token tags, in the low two bits of each varint token
+_DELTA = 0    # zigzag delta to the previous value
+_REPEAT = 1   # previous value repeated (n >> 2) + 1 times
+_MISSING = 2  # (n >> 2) + 1 missing samples
+
+# Longest run a single one-byte token can hold
+_MAX_RUN = 32
+
+
+class SampleHistory:
+    """
+    Delta + varint encoded sample history in fixed-size bytearray chunks.
+
+    Each sample becomes a token: the zigzag-encoded difference to the previous
+    value, or part of a run of repeated or missing samples that is extended in
+    place. Slowly changing readings take one byte or less per sample.
+
+    A sparse index keeps the first sample number and the value preceding each
+    chunk, so a window can be decoded starting at the right chunk without
+    touching anything before it. Once more than `capacity` samples are held,
+    whole chunks are dropped from the old end and their buffers reused.
+    """
+
+    def __init__(self, capacity=172800, chunk_size=512):
+        """
+        Initialize the history.
+
+        Args:
+            capacity: Number of samples to keep (172800 = 24 h at 500 ms)
+            chunk_size: Bytes per chunk
+        """
+        self.capacity = capacity
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.lengths = []             # used bytes per chunk
+        self.starts = array('I')      # sample number of each chunk's first sample
+        self.bases = bytearray()      # value preceding each chunk's first sample
+        self.next_index = 0           # sample number of the next append
+        self._free = []
+        self._previous = 0
+        self._run_tag = -1            # tag of the run token at the chunk's end
+        self._run_length = 0
+
+    ###############################################
+    # Appending
+
+    def _new_chunk(self):
+        chunk = self._free.pop() if self._free else bytearray(self.chunk_size)
+        self.chunks.append(chunk)
+        self.lengths.append(0)
+        self.starts.append(self.next_index)
+        self.bases.append(self._previous)
+        self._run_tag = -1
+
+    def _put_token(self, token):
+        if not self.chunks or self.lengths[-1] > self.chunk_size - 2:
+            self._new_chunk()
+        chunk = self.chunks[-1]
+        pos = self.lengths[-1]
+        while token > 0x7F:
+            chunk[pos] = token & 0x7F | 0x80
+            token >>= 7
+            pos += 1
+        chunk[pos] = token
+        self.lengths[-1] = pos + 1
+
+    def _extend_run(self, tag):
+        if self._run_tag == tag and self._run_length < _MAX_RUN:
+            # Rewrite the one-byte run token in place
+            self.chunks[-1][self.lengths[-1] - 1] = self._run_length << 2 | tag
+            self._run_length += 1
+            return
+        self._put_token(tag)
+        self._run_tag = tag
+        self._run_length = 1
+
+    def append(self, level):
+        """
+        Append a sample.
+
+        Args:
+            level: Sound level in dB (0-255), or None for a missing sample
+        """
+        if level is None:
+            self._extend_run(_MISSING)
+        else:
+            level = max(0, min(255, int(level)))
+            delta = level - self._previous
+            if delta == 0:
+                self._extend_run(_REPEAT)
+            else:
+                self._put_token((delta << 1 if delta > 0 else (-delta << 1) - 1) << 2 | _DELTA)
+                self._run_tag = -1
+                self._previous = level
+        self.next_index += 1
+
+        # Drop the oldest chunk once the rest still covers the capacity
+        if len(self.chunks) > 1 and self.next_index - self.starts[1] >= self.capacity:
+            self._free.append(self.chunks.pop(0))
+            self.lengths.pop(0)
+            self.starts = self.starts[1:]
+            self.bases = self.bases[1:]
+
+    ###############################################
+    # Reading
+
+    @property
+    def first_index(self):
+        """Sample number of the oldest sample held"""
+        return self.starts[0] if self.chunks else self.next_index
+
+    def __len__(self):
+        return self.next_index - self.first_index
+
+    @property
+    def nbytes(self):
+        """Bytes of encoded samples, excluding chunk slack"""
+        return sum(self.lengths) + 5 * len(self.chunks)
+
+    def _chunk_for(self, index):
+        """Position of the last chunk starting at or before index"""
+        low, high = 0, len(self.starts) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.starts[middle] <= index:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def window(self, start, end=None):
+        """
+        Iterate over samples by sample number.
+
+        Args:
+            start: First sample number (clamped to the oldest held)
+            end: Sample number to stop before, the next append by default
+
+        Yields:
+            Sound level per sample, None for missing samples
+        """
+        if end is None or end > self.next_index:
+            end = self.next_index
+        start = max(start, self.first_index)
+        if start >= end:
+            return
+
+        position = self._chunk_for(start)
+        index = self.starts[position]
+        value = self.bases[position]
+        while position < len(self.chunks):
+            chunk = self.chunks[position]
+            length = self.lengths[position]
+            pos = 0
+            while pos < length:
+                token = 0
+                shift = 0
+                while True:
+                    byte = chunk[pos]
+                    pos += 1
+                    token |= (byte & 0x7F) << shift
+                    if byte < 0x80:
+                        break
+                    shift += 7
+
+                tag = token & 3
+                if tag == _DELTA:
+                    zigzag = token >> 2
+                    value += (zigzag >> 1) if not zigzag & 1 else -((zigzag + 1) >> 1)
+                    count = 1
+                    sample = value
+                else:
+                    count = (token >> 2) + 1
+                    sample = value if tag == _REPEAT else None
+
+                # Skip the part of the token before the window
+                if index + count <= start:
+                    index += count
+                    continue
+                if index < start:
+                    count -= start - index
+                    index = start
+                for _ in range(count):
+                    if index >= end:
+                        return
+                    yield sample
+                    index += 1
+            position += 1
+
+    def last(self, count):
+        """Iterate over the most recent count samples, oldest first"""
+        return self.window(self.next_index - count)
+
+
+###############################################
+# Main
+if __name__ == "__main__":
+    import random
+    import time
+
+    def trace(samples, seed):
+        """Quiet room with slow drift, conversations, loud bursts and sensor dropouts"""
+        rng = random.Random(seed)
+        level = 45
+        loud = 0
+        for _ in range(samples):
+            if loud:
+                loud -= 1
+                yield max(0, min(120, level + 20 + rng.randint(-4, 4)))
+                continue
+            if rng.random() < 0.0005:
+                loud = rng.randint(20, 600)
+            if rng.random() < 0.0002:
+                for _ in range(rng.randint(1, 10)):
+                    yield None
+            if rng.random() < 0.05:
+                level = max(35, min(70, level + rng.choice((-1, 1))))
+            yield level + (rng.randint(-1, 1) if rng.random() < 0.3 else 0)
+
+    SAMPLES = 172800  # 24 h at 500 ms
+    samples = list(trace(SAMPLES, 33))
+    history = SampleHistory(capacity=SAMPLES)
+    start = time.perf_counter()
+    for sample in samples:
+        history.append(sample)
+    append_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decoded = list(history.window(0))
+    iterate_s = time.perf_counter() - start
+    assert decoded == samples, "round trip mismatch"
+
+    start = time.perf_counter()
+    tail = list(history.last(120))
+    tail_s = time.perf_counter() - start
+    assert tail == samples[-120:]
+
+    print(f"{SAMPLES} samples in {history.nbytes} bytes "
+          f"({history.nbytes / SAMPLES:.2f} bytes/sample, {len(history.chunks)} chunks; "
+          f"a MicroPython list of ints takes 4 bytes/sample, a raw bytearray 1)")
+    print(f"append {append_s / SAMPLES * 1e6:.2f} us/sample, "
+          f"full iteration {iterate_s / SAMPLES * 1e6:.2f} us/sample, "
+          f"last 60 s window {tail_s * 1e3:.2f} ms")
+
+    # Eviction keeps the most recent capacity samples
+    small = SampleHistory(capacity=1000, chunk_size=64)
+    for sample in samples[:5000]:
+        small.append(sample)
+    assert len(small) >= 1000 and list(small.last(1000)) == samples[4000:5000]
+    print(f"capacity 1000: holds {len(small)} samples in {len(small.chunks)} chunks")
@@ -0,0 +1,443 @@
+"""
+Self-tuning, self-recovering I2C bus for the sensor
+"""
+from ticks import ticks_ms, ticks_us, ticks_diff
+
+
+def _machine_i2c(bus_id, scl, sda, freq, timeout_us):
+    import machine
+    return machine.I2C(bus_id, scl=machine.Pin(scl), sda=machine.Pin(sda), freq=freq,
+                       timeout=timeout_us)
+
+
+def _machine_pin(pin, value=None):
+    """Open-drain GPIO used to bit-bang the bus during recovery"""
+    import machine
+    return machine.Pin(pin, machine.Pin.OPEN_DRAIN, value=1 if value is None else value)
+
+
+class I2CBus:
+    """
+    Drop-in replacement for machine.I2C with frequency tuning and recovery.
+
+    tune() probes the device from the fastest frequency down and keeps the
+    first one where every probe read succeeds. After `max_failures`
+    consecutive errors the bus is considered stuck and recovered in steps:
+    release the pins, clock SCL until the device lets go of SDA, send a STOP,
+    re-initialize and probe. Each call does at most `budget_us` of recovery
+    work and raises OSError instead of waiting, so a stuck bus never stalls
+    the caller's schedule. Failed recoveries back off exponentially.
+
+    Lockups and error bursts say nothing about the clock speed, so
+    recoveries don't change it. Instead the error rate is checked every
+    `rate_window` reads: above `max_error_rate` the bus drops to the next
+    lower frequency. After `retune_ms` without a drop it probes the next
+    higher one again, up to the frequency tune() chose. The probe reads are
+    spread over as many calls as the budget needs, switching to the higher
+    frequency and back in each, and only a failed read abandons the attempt.
+    """
+
+    FREQUENCIES = (400_000, 200_000, 100_000)
+
+    # Recovery states
+    OK = 0
+    RELEASE = 1   # bit-bang SCL until SDA is released
+    REINIT = 2    # recreate the controller and probe the device
+    BACKOFF = 3   # wait before the next recovery attempt
+
+    def __init__(self, bus_id, scl, sda, address, probe_reg=0x00, frequencies=FREQUENCIES,
+                 probe_reads=16, max_failures=3, budget_us=2000, backoff_ms=100,
+                 rate_window=200, max_error_rate=0.05, retune_ms=3_600_000,
+                 i2c_factory=None, pin_factory=None):
+        """
+        Initialize the bus at the slowest frequency. Call tune() to speed up.
+
+        Args:
+            bus_id: I2C controller number
+            scl: SCL GPIO number
+            sda: SDA GPIO number
+            address: Address of the device used for probing
+            probe_reg: Register read when probing
+            frequencies: Candidate frequencies in Hz, fastest first
+            probe_reads: Reads that must all succeed to accept a frequency
+            max_failures: Consecutive read errors before recovering the bus
+            budget_us: Longest recovery work done within a single call. Half
+                of it is the controller's timeout, so a probe of a bus that
+                is still stuck fits.
+            backoff_ms: Wait after the first failed recovery, doubling up to 50x
+            rate_window: Reads per error rate check
+            max_error_rate: Error rate above which the frequency is lowered
+            retune_ms: Time at a lowered frequency before probing a higher one
+            i2c_factory: Callable (bus_id, scl, sda, freq, timeout_us) -> I2C,
+                machine.I2C by default
+            pin_factory: Callable (pin, value) -> open-drain Pin, machine.Pin by default
+        """
+        self.bus_id = bus_id
+        self.scl = scl
+        self.sda = sda
+        self.address = address
+        self.probe_reg = probe_reg
+        self.frequencies = tuple(frequencies)
+        self.probe_reads = probe_reads
+        self.max_failures = max_failures
+        self.budget_us = budget_us
+        self.timeout_us = budget_us // 2
+        self.backoff_ms = backoff_ms
+        self.rate_window = rate_window
+        self.max_error_rate = max_error_rate
+        self.retune_ms = retune_ms
+        self._i2c_factory = i2c_factory or _machine_i2c
+        self._pin_factory = pin_factory or _machine_pin
+
+        self.freq_index = len(self.frequencies) - 1
+        self.tuned_index = self.freq_index  # fastest frequency retuning may return to
+        self.state = self.OK
+        self.failures = 0           # read errors since start
+        self.recoveries = 0         # successful recoveries since start
+        self._consecutive = 0
+        self._window_reads = 0
+        self._window_errors = 0
+        self._freq_changed = ticks_ms()
+        self._retune_reads = 0      # probe reads passed at the next higher frequency
+        self._pulses = 0
+        self._backoff_ms = 0
+        self._backoff_start = 0
+        self._scl_pin = None
+        self._sda_pin = None
+        self.i2c = self._new_controller()
+
+    @property
+    def freq(self):
+        return self.frequencies[self.freq_index]
+
+    ###############################################
+    # Frequency tuning
+
+    def _new_controller(self):
+        return self._i2c_factory(self.bus_id, self.scl, self.sda, self.freq, self.timeout_us)
+
+    def _probe(self, reads, budget_us=None):
+        """
+        Read the probe register up to `reads` times.
+
+        Args:
+            reads: Reads to do
+            budget_us: Stop early once a read that times out could overrun it
+
+        Returns:
+            Number of reads done, all successful; None if one failed
+        """
+        start = ticks_us()
+        for done in range(reads):
+            if (budget_us is not None
+                    and ticks_diff(ticks_us(), start) > budget_us - self.timeout_us):
+                return done
+            try:
+                self.i2c.readfrom_mem(self.address, self.probe_reg, 1)
+            except OSError:
+                return None
+        return reads
+
+    def _set_freq(self, index):
+        self.freq_index = index
+        self.i2c = self._new_controller()
+        self._freq_changed = ticks_ms()
+        self._window_reads = self._window_errors = 0
+        self._retune_reads = 0
+
+    def tune(self):
+        """
+        Settle on the fastest frequency where probe_reads reads all succeed.
+
+        Returns:
+            The chosen frequency in Hz
+        """
+        for index in range(len(self.frequencies)):
+            self._set_freq(index)
+            if self._probe(self.probe_reads) == self.probe_reads:
+                break
+        # Falls through to the slowest frequency if none was reliable
+        self.tuned_index = self.freq_index
+        return self.freq
+
+    def _count(self, failed):
+        """Track the error rate, lowering the frequency when it is too high"""
+        self._window_reads += 1
+        self._window_errors += failed
+        if self._window_reads < self.rate_window:
+            return
+        if (self._window_errors > self.max_error_rate * self._window_reads
+                and self.freq_index < len(self.frequencies) - 1):
+            self._set_freq(self.freq_index + 1)
+        else:
+            self._window_reads = self._window_errors = 0
+
+    def _retune(self):
+        """
+        Probe the next higher frequency after a quiet spell at a lowered one,
+        as many reads per call as fit into budget_us.
+        """
+        if ticks_diff(ticks_ms(), self._freq_changed) < self.retune_ms:
+            return
+        index = self.freq_index
+        self.freq_index = index - 1
+        self.i2c = self._new_controller()
+        done = self._probe(self.probe_reads - self._retune_reads, self.budget_us)
+        if done is not None:
+            self._retune_reads += done
+            if self._retune_reads >= self.probe_reads:
+                self._set_freq(index - 1)
+                return
+        # Not finished, or failed: back to the current frequency meanwhile
+        self.freq_index = index
+        self.i2c = self._new_controller()
+        if done is None:
+            # Try again after another retune_ms
+            self._retune_reads = 0
+            self._freq_changed = ticks_ms()
+
+    ###############################################
+    # machine.I2C interface
+
+    def readfrom_mem(self, addr, memaddr, nbytes):
+        """Read like machine.I2C.readfrom_mem, raising OSError while unavailable."""
+        self._check()
+        try:
+            data = self.i2c.readfrom_mem(addr, memaddr, nbytes)
+        except OSError:
+            self._failed()
+            raise
+        self._succeeded()
+        return data
+
+    def writeto_mem(self, addr, memaddr, buf):
+        """Write like machine.I2C.writeto_mem, raising OSError while unavailable."""
+        self._check()
+        try:
+            self.i2c.writeto_mem(addr, memaddr, buf)
+        except OSError:
+            self._failed()
+            raise
+        self._succeeded()
+
+    def _failed(self):
+        self.failures += 1
+        self._consecutive += 1
+        self._count(1)
+        if self._consecutive >= self.max_failures:
+            self._start_recovery()
+
+    def _succeeded(self):
+        self._consecutive = 0
+        self._count(0)
+        if self.freq_index > self.tuned_index:
+            self._retune()
+
+    def _check(self):
+        """Advance a pending recovery; raise if the bus is still unusable."""
+        if self.state != self.OK:
+            self.step()
+            if self.state != self.OK:
+                raise OSError(5, "I2C bus recovering")  # EIO
+
+    ###############################################
+    # Recovery
+
+    def _start_recovery(self):
+        self.state = self.RELEASE
+        self._pulses = 0
+        self._scl_pin = self._pin_factory(self.scl, 1)
+        self._sda_pin = self._pin_factory(self.sda, 1)
+
+    def _half_clock(self):
+        # ~100 kHz bit-banged clock
+        start = ticks_us()
+        while ticks_diff(ticks_us(), start) < 5:
+            pass
+
+    def step(self):
+        """
+        Do at most budget_us of recovery work.
+
+        Returns:
+            Whether the bus is usable
+        """
+        start = ticks_us()
+        while self.state != self.OK and ticks_diff(ticks_us(), start) < self.budget_us:
+            if self.state == self.RELEASE:
+                # Up to 9 clocks let a device finish the byte it is stuck in
+                if self._sda_pin.value() and self._pulses:
+                    self._send_stop()
+                    self.state = self.REINIT
+                elif self._pulses >= 9:
+                    self._send_stop()
+                    self.state = self.REINIT
+                else:
+                    self._scl_pin.value(0)
+                    self._half_clock()
+                    self._scl_pin.value(1)
+                    self._half_clock()
+                    self._pulses += 1
+
+            elif self.state == self.REINIT:
+                if ticks_diff(ticks_us(), start) > self.budget_us - self.timeout_us:
+                    break  # a timed out probe would overrun the budget, next call
+                self.i2c = self._new_controller()
+                if self._probe(1):
+                    self.state = self.OK
+                    self.recoveries += 1
+                    self._consecutive = 0
+                    self._backoff_ms = 0
+                else:
+                    self._backoff_ms = min(50 * self.backoff_ms, self._backoff_ms * 2 or self.backoff_ms)
+                    self._backoff_start = ticks_ms()
+                    self.state = self.BACKOFF
+
+            elif self.state == self.BACKOFF:
+                if ticks_diff(ticks_ms(), self._backoff_start) < self._backoff_ms:
+                    break
+                self._start_recovery()
+        return self.state == self.OK
+
+    def _send_stop(self):
+        # SDA low -> high while SCL is high
+        self._sda_pin.value(0)
+        self._half_clock()
+        self._scl_pin.value(1)
+        self._half_clock()
+        self._sda_pin.value(1)
+        self._half_clock()
+
+
+###############################################
+# Main
+if __name__ == "__main__":
+    # Fault-injection run against a simulated sensor
+    import random
+
+    class SimulatedBus:
+        """
+        Shared state of a simulated bus with a sensor that:
+          - fails reads with probability error_rate above max_freq
+          - occasionally locks up, holding SDA low until clocked stuck_pulses times
+            (sometimes more than one recovery's worth)
+          - has bursts of transient errors
+        Every transfer takes about 40 clock periods, as a register read does.
+        """
+
+        def __init__(self, max_freq=200_000, error_rate=0.3, lockup_rate=0.002,
+                     stuck_pulses=5, burst_rate=0.003, seed=34):
+            self.rng = random.Random(seed)
+            self.max_freq = max_freq
+            self.error_rate = error_rate
+            self.lockup_rate = lockup_rate
+            self.stuck_pulses = stuck_pulses
+            self.burst_rate = burst_rate
+            self.stuck = 0      # remaining SCL pulses until SDA is released
+            self.burst = 0
+            self.level = 50
+
+        def i2c(self, bus_id, scl, sda, freq, timeout_us):
+            bus = self
+
+            def timeout():
+                # A held bus is only noticed once the controller times out
+                start = ticks_us()
+                while ticks_diff(ticks_us(), start) < timeout_us:
+                    pass
+                return OSError(116)  # ETIMEDOUT
+
+            def transfer():
+                start = ticks_us()
+                while ticks_diff(ticks_us(), start) < 40_000_000 // freq:
+                    pass
+
+            class SimulatedI2C:
+                def readfrom_mem(self, addr, reg, nbytes):
+                    if bus.stuck:
+                        raise timeout()
+                    if bus.burst:
+                        bus.burst -= 1
+                        raise OSError(5)
+                    transfer()
+                    if bus.rng.random() < bus.lockup_rate:
+                        bus.stuck = bus.rng.choice((bus.stuck_pulses, 4 * bus.stuck_pulses))
+                        raise timeout()
+                    if bus.rng.random() < bus.burst_rate:
+                        bus.burst = bus.rng.randint(1, 6)
+                        raise OSError(5)
+                    if freq > bus.max_freq and bus.rng.random() < bus.error_rate:
+                        raise OSError(5)
+                    bus.level = max(30, min(110, bus.level + bus.rng.randint(-2, 2)))
+                    return bytes((bus.level,) * nbytes)
+
+                def writeto_mem(self, addr, reg, buf):
+                    self.readfrom_mem(addr, reg, 1)
+
+            return SimulatedI2C()
+
+        def pin(self, pin, value):
+            bus = self
+
+            class SimulatedPin:
+                def __init__(self):
+                    self.level = value
+
+                def value(self, level=None):
+                    if level is None:
+                        # SDA reads low while the device holds it
+                        return 0 if pin == 2 and bus.stuck else self.level
+                    if pin == 3 and self.level == 0 and level == 1 and bus.stuck:
+                        bus.stuck -= 1  # rising SCL edge
+                    self.level = level
+
+            return SimulatedPin()
+
+    import time
+
+    # Time runs 250x faster than on the device: 2 ms sampling period, 0.4 ms
+    # backoff, 4 s before retuning. In the middle third the sensor is only
+    # reliable at 100 kHz (a noisy cable, say); the bus should drop to it and
+    # climb back to the tuned frequency afterwards.
+    SAMPLES = 6000
+    PERIOD_S = 0.002
+    sim = SimulatedBus()
+    bus = I2CBus(1, scl=3, sda=2, address=0x48, backoff_ms=0.4, retune_ms=4000,
+                 i2c_factory=sim.i2c, pin_factory=sim.pin)
+    print(f"tuned to {bus.tune()} Hz (sensor reliable up to {sim.max_freq} Hz)")
+
+    missing = zeros = 0
+    worst_us = 0
+    freqs = [(0, bus.freq)]
+    for n in range(SAMPLES):
+        sim.max_freq = 100_000 if SAMPLES // 3 <= n < 2 * SAMPLES // 3 else 200_000
+        start = ticks_us()
+        try:
+            level = bus.readfrom_mem(0x48, 0x0A, 1)[0]
+            zeros += level == 0
+        except OSError:
+            missing += 1
+        worst_us = max(worst_us, ticks_diff(ticks_us(), start))
+        if bus.freq != freqs[-1][1]:
+            freqs.append((n, bus.freq))
+        time.sleep(PERIOD_S)
+
+    print(f"{SAMPLES} reads: {missing} missing ({missing / SAMPLES:.2%}), {zeros} zeros, "
+          f"{bus.recoveries} recoveries, {bus.failures} errors")
+    print("frequency by read: " + ", ".join(f"{n}: {freq // 1000} kHz" for n, freq in freqs))
+    print(f"longest single read incl. recovery work: {worst_us} us (budget {bus.budget_us} us)")
+    assert bus.freq == 200_000 and zeros == 0
+
+    # Climbing back at real transfer times: 16 probe reads at 200 kHz don't
+    # fit into one call's budget, so they are spread over several reads
+    sim = SimulatedBus(lockup_rate=0, burst_rate=0)
+    bus = I2CBus(1, scl=3, sda=2, address=0x48, retune_ms=0,
+                 i2c_factory=sim.i2c, pin_factory=sim.pin)
+    bus.tune()
+    bus._set_freq(bus.freq_index + 1)
+    for n in range(200):
+        bus.readfrom_mem(0x48, 0x0A, 1)
+        if bus.freq == 200_000:
+            break
+    print(f"retuned from 100 kHz to {bus.freq // 1000} kHz after {n + 1} reads")
+    assert bus.freq == 200_000
@@ -1,12 +1,25 @@
+import gc
 import time
 import sys
-from machine import Timer
+import select
+import binascii
+from machine import Timer, unique_id
 from dbmeter import DBMeter
 from lcd import LCD_1inch69
 from touch import Touch_CST816D
 from bar_gauge import BarGauge
+from alerts import AlertEngine, AlertRule
+from sensor_trace import TraceRecorder
+from probe import Probe, STAGE_TICK, STAGE_I2C, STAGE_ALERTS, STAGE_DRAW, STAGE_TEXT, STAGE_SHOW, STAGE_NOTIFY, STAGE_JITTER
+from stats import RollingStats
+from metrics_server import MetricsServer
+from mqtt import MQTTPublisher
+from history import SampleHistory
+from timesync import TimeService, SampleBatch
+from pages import PageManager, LivePage, StatsPage, HistoryPage, StatusPage, stats_snapshot, history_columns
 from typing import Union
 from urandom import randint
+import urequests
 
 #Pin definition  引脚定义
 I2C_SDA = 4  # Touch: I2C0 SDA on GP4
@@ -23,13 +36,76 @@ RST = 8
 
 BL = 15
 
+# Sampling period of the meter timer
+SAMPLE_PERIOD_MS = 500
+
+# Port of the HTTP metrics endpoint (/metrics and /metrics.json)
+METRICS_PORT = 80
+
+# MQTT broker for readings and alerts, enabled by setting MQTT_HOST in secret.py
+try:
+    from secret import MQTT_HOST
+except ImportError:
+    MQTT_HOST = None
+MQTT_RECONNECT_MS = 30000
+
+# NTP server for wall-clock timestamps, overridable with NTP_HOST in secret.py
+try:
+    from secret import NTP_HOST
+except ImportError:
+    NTP_HOST = "pool.ntp.org"
+
+# Local time offset from UTC in seconds for scheduled alert rules, set with
+# UTC_OFFSET_S in secret.py. A fixed offset: daylight saving is not applied.
+try:
+    from secret import UTC_OFFSET_S
+except ImportError:
+    UTC_OFFSET_S = 0
+
+# Collector ingest URL (collector/server.py) for timestamped sample batches,
+# enabled by setting COLLECTOR_URL in secret.py
+try:
+    from secret import COLLECTOR_URL
+except ImportError:
+    COLLECTOR_URL = None
+UPLOAD_PERIOD_MS = 60000
+
+# Where the "record" serial command writes sensor traces
+TRACE_PATH = "trace.dbt"
+
+# Hours of samples kept in the compressed in-RAM history
+HISTORY_HOURS = 24
+
+# Minutes of history shown on the history page
+HISTORY_PAGE_MINUTES = 10
+
+# Record per-stage timings of the sampling path (query with "stats" over serial)
+PROBE_ENABLED = True
+
+# Shared no-op probe for callers that don't record timings
+_NO_PROBE = Probe(enabled=False)
+
+# Alert rules, evaluated on every sample
+ALERT_RULES = [
+    AlertRule("loud", threshold=70, sustain_s=3, hysteresis=5, channels=("push", "mqtt")),
+    AlertRule("peak", threshold=85, cooldown_s=60, channels=("push", "mqtt")),
+    AlertRule("leq", threshold=65, metric=AlertRule.LEQ, window_s=30, cooldown_s=300),
+    AlertRule("night", threshold=55, sustain_s=10, hours=(22, 7), cooldown_s=600,
+              channels=("push", "serial")),
+]
+
 
 #Volume Meter UI  音量计UI
 class VolmeMeterUI:
     
     custom_bar_color: Union[int, None] = None
     
-    def __init__(self, lcd: LCD_1inch69, min_db=0, max_db=100):
+    # Position and scale of the large dB readout
+    DIGITS_X = 80
+    DIGITS_Y = 180
+    DIGITS_SIZE = 5
+
+    def __init__(self, lcd: LCD_1inch69, min_db=0, max_db=100, probe=None, static_layer=True):
         """
         Initialize the volume meter UI
 
@@ -37,12 +113,27 @@ class VolmeMeterUI:
             lcd: LCD_1inch69 display object
             min_db: Minimum decibel value for the scale
             max_db: Maximum decibel value for the scale
+            probe: Optional Probe recording draw, text and show timings
+            static_layer: Render the static chrome once and restore it per frame
+                instead of redrawing the whole screen
         """
         self.lcd = lcd
+        self.probe = probe or _NO_PROBE
         self.min_db = min_db
         self.max_db = max_db
         self.current_db = 0
 
+        # Theme
+        self.background = lcd.white
+        self.foreground = lcd.black
+
+        # Static layer cache: snapshot of the rows the dynamic elements draw
+        # over, and the settings it was rendered with
+        self.static_layer = static_layer
+        self._layer = None
+        self._layer_bands = ()
+        self._layer_key = None
+
         # Initialize gauge renderer
 
         # Bar gauge
@@ -77,40 +168,220 @@ class VolmeMeterUI:
         self.current_db = db_value
         self.draw()
     
-    def draw(self):
-        """Draw the volume meter UI"""
-        # Clear screen with white background
-        self.lcd.fill(self.lcd.white)
-
-        # Title
-        self.lcd.write_text('Volume Level', 25, 20, 2, self.lcd.black)
+    def write_text(self, text, x, y, size, color):
+        """Write text on the LCD, timed under the text stage"""
+        start = self.probe.begin()
+        self.lcd.write_text(text, x, y, size, color)
+        self.probe.end(STAGE_TEXT, start)
 
-        # Calculate fill percentage based on current dB
-        db_range = self.max_db - self.min_db
-        fill_percent = (self.current_db - self.min_db) / db_range
-        # Clamp to 0-1 range
-        fill_percent = max(0.0, min(1.0, fill_percent))
+    def invalidate(self):
+        """Force the static layer to be rebuilt on the next frame"""
+        self._layer_key = None
 
-        # Get color for current level
-        bar_color = self.custom_bar_color or self.get_color_for_db(self.current_db)
+    def draw_chrome(self):
+        """Draw the static elements: background, title, bar outline and labels"""
+        # Clear screen with background color
+        self.lcd.fill(self.background)
 
-        # Render appropriate gauge based on mode
-        self.bar_gauge.draw(fill_percent, bar_color)
+        # Title
+        self.write_text('Volume Level', 25, 20, 2, self.foreground)
 
-        # Draw dB value as large text (centered below gauge)
-        db_text = str(int(self.current_db))
-        self.lcd.write_text(db_text, 80, 180, 5, bar_color)
+        self.bar_gauge.draw_outline(self.foreground)
 
         # Draw "dB" label
-        self.lcd.write_text('dB', 170, 195, 3, self.lcd.black)
+        self.write_text('dB', 170, 195, 3, self.foreground)
 
         # Draw min/max range indicators
-        self.lcd.write_text(str(self.min_db), 20, 155, 2, self.lcd.black)
-        self.lcd.write_text(str(self.max_db), 180, 155, 2, self.lcd.black)
+        self.write_text(str(self.min_db), 20, 155, 2, self.foreground)
+        self.write_text(str(self.max_db), 180, 155, 2, self.foreground)
+
+    def _build_layer(self):
+        """Render the chrome into the framebuffer and cache the dynamic rows"""
+        self.draw_chrome()
+
+        # Rows overwritten every frame: inside the bar outline, and the readout
+        gauge = self.bar_gauge
+        stride = self.lcd.width * 2
+        rows = ((gauge.y + 1, gauge.bar_height - 2),
+                (self.DIGITS_Y, 8 * self.DIGITS_SIZE))
+        self._layer_bands = tuple((y * stride, height * stride) for y, height in rows)
+
+        size = sum(length for _, length in self._layer_bands)
+        if self._layer is None or len(self._layer) != size:
+            self._layer = bytearray(size)
+        buffer = memoryview(self.lcd.buffer)
+        offset = 0
+        for start, length in self._layer_bands:
+            self._layer[offset:offset + length] = buffer[start:start + length]
+            offset += length
+
+    def _restore_layer(self):
+        """Bring back the static chrome under the dynamic elements"""
+        gauge = self.bar_gauge
+        key = (self.min_db, self.max_db, self.background, self.foreground,
+               gauge.x, gauge.y, gauge.bar_width, gauge.bar_height)
+        if key != self._layer_key:
+            # Rebuilding leaves the whole chrome in the framebuffer
+            self._build_layer()
+            self._layer_key = key
+            return
+
+        buffer = self.lcd.buffer
+        layer = memoryview(self._layer)
+        offset = 0
+        for start, length in self._layer_bands:
+            buffer[start:start + length] = layer[offset:offset + length]
+            offset += length
+
+    def draw(self):
+        """Draw the volume meter UI"""
+        draw_start = self.probe.begin()
+
+        if self.static_layer:
+            self._restore_layer()
+        else:
+            self.draw_chrome()
+
+        if self.current_db is None:
+            # Missing sample: empty gauge and dashes
+            fill_percent = 0.0
+            bar_color = self.foreground
+            db_text = "--"
+        else:
+            # Calculate fill percentage based on current dB
+            db_range = self.max_db - self.min_db
+            fill_percent = (self.current_db - self.min_db) / db_range
+            # Clamp to 0-1 range
+            fill_percent = max(0.0, min(1.0, fill_percent))
+
+            # Get color for current level
+            bar_color = self.custom_bar_color or self.get_color_for_db(self.current_db)
+
+            # Draw dB value as large text (centered below gauge)
+            db_text = str(int(self.current_db))
+
+        # Render appropriate gauge based on mode
+        self.bar_gauge.draw_fill(fill_percent, bar_color)
+
+        self.write_text(db_text, self.DIGITS_X, self.DIGITS_Y, self.DIGITS_SIZE, bar_color)
 
         # Update display
+        show_start = self.probe.begin()
         self.lcd.show()
-  
+        self.probe.end(STAGE_SHOW, show_start)
+
+        self.probe.end(STAGE_DRAW, draw_start)
+
+
+def process_sample(db_meter, alert_engine, vm_ui=None, probe=None, stats=None, publisher=None,
+                   history=None, batch=None):
+    """
+    Run one sampling tick: read the meter, update statistics, send any alerts
+    and redraw.
+
+    Shared by the live timer callback and trace replay.
+
+    Args:
+        db_meter: DBMeter (or sensor_trace.ReplayDBMeter) to read from
+        alert_engine: AlertEngine evaluating the sample
+        vm_ui: Optional VolmeMeterUI or pages.PageManager to redraw, None to
+            run headless
+        probe: Optional Probe recording stage timings
+        stats: Optional RollingStats to add the sample to
+        publisher: Optional MQTTPublisher to queue the reading and "mqtt"
+            alerts on; its poll() in the main loop sends them
+        history: Optional SampleHistory to append the sample to
+        batch: Optional timesync.SampleBatch collecting samples for upload
+
+    Returns:
+        The sound level read
+    """
+    if probe is None:
+        probe = _NO_PROBE
+    tick_start = probe.begin()
+
+    stage_start = probe.begin()
+    sound_level = db_meter.current_decibel
+    probe.end(STAGE_I2C, stage_start)
+
+    if stats:
+        stats.add(sound_level)
+    if history is not None:
+        history.append(sound_level)
+    if batch is not None:
+        batch.add(sound_level)
+    if publisher and sound_level is not None:
+        publisher.publish_reading(sound_level)
+
+    stage_start = probe.begin()
+    fired = alert_engine.feed(sound_level)
+    probe.end(STAGE_ALERTS, stage_start)
+    for rule, channel, value in fired:
+        if channel == "push":
+            stage_start = probe.begin()
+            db_meter.notify(body=rule.message(value), title=rule.title, check_cooldown=False)
+            probe.end(STAGE_NOTIFY, stage_start)
+        elif channel == "mqtt":
+            if publisher:
+                publisher.publish_alert(rule.message(value))
+        else:
+            print(f"Alert [{rule.name}]: {rule.message(value)}")
+
+    if vm_ui:
+        vm_ui.update_decibel(sound_level)
+    probe.end(STAGE_TICK, tick_start)
+    return sound_level
+
+
+def device_status(db_meter, publisher=None, time_service=None):
+    """Rows for the status page"""
+    uptime_s = time.ticks_ms() // 1000
+    rows = [("Uptime", f"{uptime_s // 3600}h {uptime_s // 60 % 60:02d}m"),
+            ("Heap", f"{gc.mem_free() // 1024} kB"),
+            ("I2C", f"{db_meter.i2c.freq // 1000} kHz"),
+            ("Resets", str(db_meter.i2c.recoveries))]
+    try:
+        import network
+        rows.append(("IP", network.WLAN().ipconfig('addr4')[0]))
+    except Exception:
+        rows.append(("IP", "--"))
+    if publisher:
+        rows.append(("MQTT", "up" if publisher.connected else "down"))
+    if time_service:
+        rows.append(("NTP", f"{round(time_service.drift_ppm)} ppm" if time_service.synced else "--"))
+    return tuple(rows)
+
+
+def benchmark_draw(lcd, frames=50):
+    """
+    Compare frame times with and without the cached static layer.
+
+    Run from the REPL with the meter stopped:
+        >>> from main import benchmark_draw
+        >>> from lcd import LCD_1inch69
+        >>> benchmark_draw(LCD_1inch69())
+
+    Args:
+        lcd: LCD_1inch69 display object
+        frames: Number of frames to draw per mode
+
+    Returns:
+        Dict of mode name to (mean frame us, p50 show us)
+    """
+    results = {}
+    for name, static_layer in (("full redraw", False), ("static layer", True)):
+        probe = Probe()
+        ui = VolmeMeterUI(lcd, min_db=0, max_db=100, probe=probe, static_layer=static_layer)
+        ui.update_decibel(0)  # builds the layer, not counted
+        probe.reset()
+        start = time.ticks_us()
+        for frame in range(frames):
+            ui.update_decibel(30 + frame % 70)
+        frame_us = time.ticks_diff(time.ticks_us(), start) // frames
+        results[name] = (frame_us, probe.percentile(STAGE_SHOW, 0.5))
+        print(f"{name:>12}: {frame_us}us per frame (show p50 {results[name][1]}us)")
+    return results
+
 if __name__=='__main__':
     # Wrap everything in try/except to prevent blocking REPL
     try:
@@ -118,6 +389,7 @@ if __name__=='__main__':
         LCD = None
         vm_ui = None
         db_meter = None
+        probe = Probe(enabled=PROBE_ENABLED)
 
         try:
             LCD = LCD_1inch69()
@@ -129,7 +401,7 @@ if __name__=='__main__':
         if LCD:
             try:
                 # Initialize volume meter UI
-                vm_ui = VolmeMeterUI(LCD, min_db=0, max_db=100)
+                vm_ui = VolmeMeterUI(LCD, min_db=0, max_db=100, probe=probe)
                 print("Volume Meter initialized")
             except Exception as e:
                 print(f"VolmeMeterUI init failed: {e}")
@@ -157,33 +429,138 @@ if __name__=='__main__':
             import sys
             sys.exit()
 
+        # Wall-clock time for uploaded batches and scheduled alert rules; synced
+        # from the main loop. Scheduled rules stay off until the first sync.
+        time_service = TimeService(NTP_HOST, utc_offset_s=UTC_OFFSET_S)
+        alert_engine = AlertEngine(ALERT_RULES, period_ms=SAMPLE_PERIOD_MS,
+                                   clock=lambda: time_service.hour)
+        stats = RollingStats()
+        history = SampleHistory(capacity=HISTORY_HOURS * 3600 * 1000 // SAMPLE_PERIOD_MS)
+
+        metrics_server = None
+        try:
+            metrics_server = MetricsServer(stats, probe, port=METRICS_PORT)
+            print(f"Metrics endpoint listening on port {METRICS_PORT}")
+        except Exception as e:
+            print(f"Metrics endpoint failed: {e}")
+            print("Continuing without metrics endpoint")
+
+        device_id = binascii.hexlify(unique_id()).decode()
+
+        publisher = None
+        if MQTT_HOST:
+            try:
+                publisher = MQTTPublisher(device_id, MQTT_HOST)
+                publisher.connect()
+                print(f"MQTT connected to {MQTT_HOST}")
+            except Exception as e:
+                print(f"MQTT connect failed: {e}")
+                print(f"Retrying every {MQTT_RECONNECT_MS // 1000}s")
+        mqtt_attempt = time.ticks_ms()
+
+        batch = SampleBatch(capacity=2 * UPLOAD_PERIOD_MS // SAMPLE_PERIOD_MS) if COLLECTOR_URL else None
+        upload_attempt = time.ticks_ms()
+
+        # Swipeable pages; only the one on screen is drawn and fed data
+        pages = PageManager(LCD, (LivePage(vm_ui, refresh_ms=SAMPLE_PERIOD_MS), StatsPage(),
+                                  HistoryPage(minutes=HISTORY_PAGE_MINUTES), StatusPage()), probe)
+        pages.add_producer("stats", stats_snapshot(stats))
+        pages.add_producer("history", history_columns(
+            history, HISTORY_PAGE_MINUTES * 60 * 1000 // SAMPLE_PERIOD_MS))
+        pages.add_producer("status", lambda: device_status(db_meter, publisher, time_service))
+
+        last_tick_us = None
+
         # Timer callback to update meter
         def update_meter(timer):
             assert vm_ui is not None, "UI should be initialized in order to update display"
             assert db_meter is not None, "DB Meter should be initialized to record volume"
             
+            global last_tick_us
             start = time.ticks_ms()
-            sound_level = db_meter.current_decibel
-            if sound_level > 70:
-                db_meter.notify()
-            vm_ui.update_decibel(sound_level)
-            elapsed = time.ticks_ms() - start
+
+            # Deviation of this tick from the sampling period
+            now_us = time.ticks_us()
+            if last_tick_us is not None:
+                interval = time.ticks_diff(now_us, last_tick_us)
+                probe.record(STAGE_JITTER, abs(interval - SAMPLE_PERIOD_MS * 1000))
+            last_tick_us = now_us
+
+            process_sample(db_meter, alert_engine, pages, probe, stats, publisher, history, batch)
+            elapsed = time.ticks_diff(time.ticks_ms(), start)
 
             if elapsed > 100:
                 print(f"Update took {elapsed}ms")
 
-        # Create timer that triggers every 500ms (0.5 seconds)
+        # Create timer that triggers every SAMPLE_PERIOD_MS (0.5 seconds)
         timer = Timer(-1)
-        timer.init(period=500, mode=Timer.PERIODIC, callback=update_meter)
+        timer.init(period=SAMPLE_PERIOD_MS, mode=Timer.PERIODIC, callback=update_meter)
         print("Starting main loop...")
 
+        # Serial commands: "stats" prints the stage table, "summary" the compact
+        # export, "reset" clears the histograms, "history" shows the history
+        # size, "record" / "stop" capture a sensor trace to TRACE_PATH
+        recorder = None
+        serial = select.poll()
+        serial.register(sys.stdin, select.POLLIN)
+
         # Keep the program running
         while True:
-            # Check for long press gesture (0x0C)
-            if touch and touch.Gestures == 0x0C:
+            time_service.poll()
+            if batch is not None and time.ticks_diff(time.ticks_ms(), upload_attempt) > UPLOAD_PERIOD_MS:
+                upload_attempt = time.ticks_ms()
+                payload = batch.payload(time_service, device_id)
+                if payload:
+                    try:
+                        response = urequests.post(COLLECTOR_URL, json=payload)
+                        response.close()
+                        if response.status_code == 200:
+                            # Samples taken during the upload stay for the next one
+                            batch.discard(len(payload["db"]))
+                        else:
+                            print(f"Upload rejected: {response.status_code}")
+                    except OSError as e:
+                        print(f"Upload failed: {e}")
+            if metrics_server:
+                metrics_server.poll()
+            if publisher:
+                publisher.poll()
+                if (not publisher.connected
+                        and time.ticks_diff(time.ticks_ms(), mqtt_attempt) > MQTT_RECONNECT_MS):
+                    mqtt_attempt = time.ticks_ms()
+                    try:
+                        publisher.connect()
+                        print("MQTT reconnected")
+                    except OSError as e:
+                        print(f"MQTT reconnect failed: {e}")
+            if serial.poll(0):
+                command = sys.stdin.readline().strip()
+                if command == "stats":
+                    probe.report()
+                elif command == "summary":
+                    print(probe.summary())
+                elif command == "reset":
+                    probe.reset()
+                elif command == "history":
+                    print(f"History: {len(history)} samples in {history.nbytes} bytes")
+                elif command == "record" and recorder is None:
+                    recorder = TraceRecorder(TRACE_PATH)
+                    db_meter.recorder = recorder
+                    print(f"Recording sensor trace to {TRACE_PATH}")
+                elif command == "stop" and recorder is not None:
+                    db_meter.recorder = None
+                    recorder.close()
+                    print(f"Recorded {recorder.records} reads to {TRACE_PATH}")
+                    recorder = None
+            # Swipe left/right (0x03/0x04) to change pages
+            if touch and pages.swipe(touch.Gestures):
+                touch.Gestures = "None"  # Reset gesture after handling
+            # Check for long press gesture (0x0C) on the meter page
+            if touch and touch.Gestures == 0x0C and pages.active.name == "live":
                 colors = [LCD.blue, LCD.black, LCD.red, LCD.yellow]
                 new_color = colors[randint(0,3)]
                 vm_ui.custom_bar_color = new_color
+                pages.refresh()
                 print(f"Updated bar color to {new_color=}")
                 touch.Gestures = "None"  # Reset gesture after handling
                 time.sleep(0.5)  # Debounce delay
@@ -0,0 +1,392 @@
+"""
+Minimal non-blocking HTTP endpoint exposing the meter's metrics
+
+    GET /metrics       Prometheus text format
+    GET /metrics.json  compact JSON
+
+Responses are rendered into a preallocated buffer, so a scrape does not
+build strings on the heap.
+"""
+import socket
+from ticks import ticks_ms, ticks_diff
+
+
+class _ResponseBuffer:
+    """
+    Preallocated byte buffer with allocation-free integer formatting.
+    """
+
+    def __init__(self, size):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.pos = 0
+
+    def put(self, data):
+        end = self.pos + len(data)
+        if end <= len(self.buffer):
+            self.buffer[self.pos:end] = data
+        self.pos = end
+
+    def put_int(self, value):
+        """Write an integer's digits without building a string"""
+        value = int(value)
+        if value < 0:
+            self.put(b"-")
+            value = -value
+        digits = 1
+        scale = 10
+        while value >= scale:
+            digits += 1
+            scale *= 10
+        end = self.pos + digits
+        if end <= len(self.buffer):
+            pos = end
+            while digits:
+                pos -= 1
+                self.buffer[pos] = 48 + value % 10
+                value //= 10
+                digits -= 1
+        self.pos = end
+
+    def put_fixed(self, value):
+        """Write a non-negative float with one decimal"""
+        tenths = int(value * 10 + 0.5)
+        self.put_int(tenths // 10)
+        self.put(b".")
+        self.put_int(tenths % 10)
+
+    @property
+    def overflowed(self):
+        return self.pos > len(self.buffer)
+
+    def contents(self):
+        return self.view[:min(self.pos, len(self.buffer))]
+
+
+class MetricsServer:
+    """
+    Serves current level, rolling stats, stage timings and uptime.
+
+    Call poll() from the main loop; it returns immediately when no client
+    is waiting and serves at most one request per call.
+    """
+
+    # Seconds a connected client gets to send its request
+    CLIENT_TIMEOUT = 0.2
+
+    _STATUS_OK = b"HTTP/1.0 200 OK\r\nContent-Type: "
+    _STATUS_NOT_FOUND = b"HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n"
+    _TYPE_TEXT = b"text/plain; version=0.0.4"
+    _TYPE_JSON = b"application/json"
+    _CONTENT_LENGTH = b"\r\nContent-Length: "
+    _END_HEADERS = b"\r\n\r\n"
+
+    def __init__(self, stats, probe=None, port=80, buffer_size=3072):
+        """
+        Initialize the server and start listening.
+
+        Args:
+            stats: RollingStats of the sampled levels
+            probe: Optional Probe whose stage timings are exported
+            port: TCP port to listen on
+            buffer_size: Size of the preallocated response buffer
+        """
+        self.stats = stats
+        self.probe = probe
+        self.started = ticks_ms()
+        self.requests = 0
+
+        self._body = _ResponseBuffer(buffer_size)
+        self._header = _ResponseBuffer(128)
+        self._request = bytearray(256)
+
+        # Per-stage label fragments, built once
+        stages = probe.stages if probe else ()
+        self._stage_labels = [(f'{{stage="{name}"}} '.encode(),
+                               f'{{stage="{name}",quantile="0.5"}} '.encode(),
+                               f'{{stage="{name}",quantile="0.99"}} '.encode(),
+                               f'"{name}":['.encode()) for name in stages]
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(socket.getaddrinfo("0.0.0.0", port)[0][-1])
+        self.sock.listen(2)
+        self.sock.setblocking(False)
+
+    def close(self):
+        """Stop listening"""
+        self.sock.close()
+
+    ###############################################
+    # Rendering
+
+    def _render_prometheus(self, out):
+        stats = self.stats
+        out.put(b"# TYPE dbmeter_level_db gauge\ndbmeter_level_db ")
+        # NaN while the latest sample is missing, rather than a stale level
+        if stats.latest is None:
+            out.put(b"NaN")
+        else:
+            out.put_int(stats.latest)
+        out.put(b"\n# TYPE dbmeter_window_db gauge\ndbmeter_window_db{stat=\"min\"} ")
+        out.put_int(stats.min)
+        out.put(b"\ndbmeter_window_db{stat=\"max\"} ")
+        out.put_int(stats.max)
+        out.put(b"\ndbmeter_window_db{stat=\"mean\"} ")
+        out.put_fixed(stats.mean)
+        out.put(b"\ndbmeter_window_db{stat=\"leq\"} ")
+        out.put_fixed(stats.leq)
+        out.put(b"\n# TYPE dbmeter_samples_total counter\ndbmeter_samples_total ")
+        out.put_int(stats.count)
+        out.put(b"\n# TYPE dbmeter_missing_samples_total counter\ndbmeter_missing_samples_total ")
+        out.put_int(stats.missing)
+        out.put(b"\n# TYPE dbmeter_uptime_seconds counter\ndbmeter_uptime_seconds ")
+        out.put_int(self.uptime_s)
+        out.put(b"\n")
+
+        probe = self.probe
+        if not (probe and probe.enabled):
+            return
+        out.put(b"# TYPE dbmeter_stage_count counter\n")
+        for stage, labels in enumerate(self._stage_labels):
+            out.put(b"dbmeter_stage_count")
+            out.put(labels[0])
+            out.put_int(probe.counts[stage])
+            out.put(b"\n")
+        out.put(b"# TYPE dbmeter_stage_us summary\n")
+        for stage, labels in enumerate(self._stage_labels):
+            out.put(b"dbmeter_stage_us")
+            out.put(labels[1])
+            out.put_int(probe.percentile(stage, 0.5))
+            out.put(b"\ndbmeter_stage_us")
+            out.put(labels[2])
+            out.put_int(probe.percentile(stage, 0.99))
+            out.put(b"\n")
+        out.put(b"# TYPE dbmeter_stage_max_us gauge\n")
+        for stage, labels in enumerate(self._stage_labels):
+            out.put(b"dbmeter_stage_max_us")
+            out.put(labels[0])
+            out.put_int(probe.max_us[stage])
+            out.put(b"\n")
+
+    def _render_json(self, out):
+        stats = self.stats
+        out.put(b'{"db":')
+        if stats.latest is None:
+            out.put(b"null")
+        else:
+            out.put_int(stats.latest)
+        out.put(b',"min":')
+        out.put_int(stats.min)
+        out.put(b',"max":')
+        out.put_int(stats.max)
+        out.put(b',"mean":')
+        out.put_fixed(stats.mean)
+        out.put(b',"leq":')
+        out.put_fixed(stats.leq)
+        out.put(b',"samples":')
+        out.put_int(stats.count)
+        out.put(b',"missing":')
+        out.put_int(stats.missing)
+        out.put(b',"uptime_s":')
+        out.put_int(self.uptime_s)
+
+        probe = self.probe
+        if probe and probe.enabled:
+            # Per stage: [count, p50 us, p99 us, max us]
+            out.put(b',"stages":{')
+            for stage, labels in enumerate(self._stage_labels):
+                if stage:
+                    out.put(b",")
+                out.put(labels[3])
+                out.put_int(probe.counts[stage])
+                out.put(b",")
+                out.put_int(probe.percentile(stage, 0.5))
+                out.put(b",")
+                out.put_int(probe.percentile(stage, 0.99))
+                out.put(b",")
+                out.put_int(probe.max_us[stage])
+                out.put(b"]")
+            out.put(b"}")
+        out.put(b"}")
+
+    def render(self, json=False):
+        """
+        Render the metrics into the response buffer.
+
+        Returns:
+            memoryview of the rendered body
+        """
+        self._body.pos = 0
+        if json:
+            self._render_json(self._body)
+        else:
+            self._render_prometheus(self._body)
+        if self._body.overflowed:
+            print(f"MetricsServer: response truncated, needs {self._body.pos} bytes")
+        return self._body.contents()
+
+    ###############################################
+    # Serving
+
+    @property
+    def uptime_s(self):
+        return ticks_diff(ticks_ms(), self.started) // 1000
+
+    def _render_header(self, content_type, length):
+        header = self._header
+        header.pos = 0
+        header.put(self._STATUS_OK)
+        header.put(content_type)
+        header.put(self._CONTENT_LENGTH)
+        header.put_int(length)
+        header.put(self._END_HEADERS)
+        return header.contents()
+
+    def poll(self):
+        """
+        Serve one pending request, if any.
+
+        Returns:
+            Whether a request was handled
+        """
+        try:
+            client, _ = self.sock.accept()
+        except OSError:
+            return False  # nobody waiting
+
+        try:
+            client.settimeout(self.CLIENT_TIMEOUT)
+            size = _recv_into(client, self._request)
+            request = memoryview(self._request)[:size]
+            if bytes(request[:17]) == b"GET /metrics.json":
+                body = self.render(json=True)
+                content_type = self._TYPE_JSON
+            elif bytes(request[:12]) == b"GET /metrics":
+                body = self.render()
+                content_type = self._TYPE_TEXT
+            else:
+                client.sendall(self._STATUS_NOT_FOUND)
+                return True
+            client.sendall(self._render_header(content_type, len(body)))
+            client.sendall(body)
+            self.requests += 1
+        except OSError as e:
+            print(f"MetricsServer: request failed: {e}")
+        finally:
+            client.close()
+        return True
+
+
+def _recv_into(client, buffer):
+    """Receive into a preallocated buffer on both MicroPython and CPython sockets"""
+    if hasattr(client, "recv_into"):
+        return client.recv_into(buffer)
+    return client.readinto(buffer) or 0
+
+
+###############################################
+# Main
+if __name__ == "__main__":
+    # Load test. With a device address, hammer its endpoint and read back the
+    # tick jitter it measured:
+    #     python metrics_server.py 192.168.1.42 [seconds]
+    # Without, run a simulated sampling loop with the server on localhost and
+    # compare its tick jitter with and without a client hammering it.
+    import json
+    import sys
+    import threading
+    import time
+    from probe import Probe, STAGE_JITTER, STAGE_TICK
+    from stats import RollingStats
+
+    def hammer(host, port, seconds, results, stop=None):
+        """Request /metrics back to back for `seconds` or until stop is set"""
+        end = time.monotonic() + seconds
+        latencies = []
+        errors = 0
+        while time.monotonic() < end and not (stop and stop.is_set()):
+            start = time.monotonic()
+            try:
+                with socket.create_connection((host, port), timeout=2) as conn:
+                    conn.sendall(b"GET /metrics HTTP/1.0\r\n\r\n")
+                    while conn.recv(4096):
+                        pass
+            except OSError:  # includes socket timeouts
+                errors += 1
+                continue
+            latencies.append(time.monotonic() - start)
+        latencies.sort()
+        if latencies:
+            results.append((len(latencies), latencies[len(latencies) // 2],
+                            latencies[int(len(latencies) * 0.99)], errors))
+        else:
+            results.append((0, 0.0, 0.0, errors))
+
+    def fetch_json(host, port):
+        with socket.create_connection((host, port), timeout=2) as conn:
+            conn.sendall(b"GET /metrics.json HTTP/1.0\r\n\r\n")
+            response = b""
+            while chunk := conn.recv(4096):
+                response += chunk
+        return json.loads(response.split(b"\r\n\r\n", 1)[1])
+
+    def report(results, seconds):
+        if not results or not results[0][0]:
+            print(f"client: no request completed ({results[0][3] if results else 0} failed)")
+            return
+        requests, p50, p99, errors = results[0]
+        print(f"client: {requests / seconds:.0f} req/s, latency p50 {p50 * 1000:.1f}ms "
+              f"p99 {p99 * 1000:.1f}ms, {errors} failed")
+
+    if len(sys.argv) > 1:
+        host = sys.argv[1]
+        seconds = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+        before = fetch_json(host, 80)["stages"]["jitter"]
+        results = []
+        hammer(host, 80, seconds, results)
+        report(results, seconds)
+        after = fetch_json(host, 80)["stages"]["jitter"]
+        print(f"device jitter (count/p50/p99/max us) before {before}, after {after}")
+        sys.exit()
+
+    PORT = 8080
+    PERIOD_US = 10_000
+    SECONDS = 5
+
+    def simulate(server, probe, seconds):
+        """Sampling loop polling the server between ticks, like main.py"""
+        from ticks import ticks_us, ticks_add
+        probe.reset()
+        next_tick = ticks_add(ticks_us(), PERIOD_US)
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            late = ticks_diff(ticks_us(), next_tick)
+            if late >= 0:
+                probe.record(STAGE_JITTER, late)
+                start = probe.begin()
+                server.stats.add(50 + int(time.monotonic() * 7) % 30)
+                probe.end(STAGE_TICK, start)
+                next_tick = ticks_add(next_tick, PERIOD_US)
+            elif not server.poll():
+                time.sleep(0.0005)
+        return probe.percentile(STAGE_JITTER, 0.99), probe.max_us[STAGE_JITTER]
+
+    probe = Probe()
+    server = MetricsServer(RollingStats(), probe, port=PORT)
+    idle = simulate(server, probe, SECONDS)
+
+    results = []
+    stop = threading.Event()
+    client = threading.Thread(target=hammer, args=("127.0.0.1", PORT, SECONDS, results, stop))
+    client.start()
+    loaded = simulate(server, probe, SECONDS)
+    # Keep serving until the client has seen its last response
+    stop.set()
+    while client.is_alive():
+        if not server.poll():
+            client.join(0.001)
+    server.close()
+
+    report(results, SECONDS)
+    print(f"tick jitter p99/max: idle {idle[0]}/{idle[1]}us, under load {loaded[0]}/{loaded[1]}us")
@@ -0,0 +1,398 @@
+"""
+Minimal MQTT 3.1.1 publisher for readings and alerts
+"""
+import select
+import socket
+from ticks import ticks_ms, ticks_diff
+
+# Packet types
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+_QOS1 = 0x02
+_DUP = 0x08
+
+
+def _remaining_length(length):
+    """Encode an MQTT remaining length field"""
+    encoded = bytearray()
+    while True:
+        byte = length & 0x7F
+        length >>= 7
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return encoded
+
+
+def _string(data):
+    """Length-prefixed MQTT string"""
+    return bytes((len(data) >> 8, len(data) & 0xFF)) + data
+
+
+class MQTTPublisher:
+    """
+    Keeps one persistent broker connection and publishes:
+
+        <prefix>/<client_id>/db     every reading, QoS0
+        <prefix>/<client_id>/alert  alerts, QoS1
+
+    publish_reading() and publish_alert() may be called from a timer
+    callback: they only queue, and every socket operation happens in poll(),
+    which has to be called regularly from the main loop. It sends the latest
+    reading and the queued alerts, processes acks, resends and keepalive
+    pings. A reading replaced before poll() sent it is not published.
+
+    The reading packet (fixed header and topic) is built once and only its
+    payload bytes change per message, so publishing a reading does not
+    allocate. Alerts are pipelined: up to max_inflight await their PUBACK at
+    once and are resent with the DUP flag if it does not arrive in time.
+    """
+
+    # Seconds a blocking socket operation may take
+    SOCKET_TIMEOUT = 2
+    # Longest reading payload ("255")
+    _READING_DIGITS = 3
+
+    def __init__(self, client_id, host, port=1883, prefix="dbmeter", user=None,
+                 password=None, keepalive=60, max_inflight=8, retry_ms=5000):
+        """
+        Initialize the publisher. Call connect() before publishing.
+
+        Args:
+            client_id: MQTT client identifier, also used in the topics
+            host: Broker host name or address
+            port: Broker port
+            prefix: First topic level
+            user: Optional user name
+            password: Optional password
+            keepalive: Keepalive interval in seconds
+            max_inflight: Most QoS1 messages queued or awaiting a PUBACK at once
+            retry_ms: Time after which an unacknowledged alert is resent
+        """
+        self.client_id = client_id
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.keepalive = keepalive
+        self.max_inflight = max_inflight
+        self.retry_ms = retry_ms
+
+        self.sock = None
+        self.connected = False
+        self.sent = 0
+        self.acked = 0
+        self.dropped = 0
+        # Packet id -> [packet, last send ticks]; only touched by the main loop
+        self.inflight = {}
+        # (packet id, packet) of alerts waiting for poll() to send them
+        self._queued = []
+        # Reading waiting for poll() to send it, None if there is none
+        self._pending_level = None
+        self._next_id = 1
+        self._last_send = 0
+        self._rx = bytearray()
+        self._poller = None
+
+        # Reading packet: fixed header, remaining length, topic; payload
+        # digits are written into the tail before each send
+        topic = f"{prefix}/{client_id}/db".encode()
+        self._reading_header_size = 2 + 2 + len(topic)
+        self._reading = bytearray(self._reading_header_size + self._READING_DIGITS)
+        self._reading[0] = PUBLISH
+        self._reading[2:self._reading_header_size] = _string(topic)
+        view = memoryview(self._reading)
+        # One view per payload length, so sending needs no new slice
+        self._reading_views = [view[:self._reading_header_size + digits]
+                               for digits in range(self._READING_DIGITS + 1)]
+        self._alert_topic = _string(f"{prefix}/{client_id}/alert".encode())
+
+    ###############################################
+    # Connection
+
+    def connect(self):
+        """
+        Open the connection and wait for the broker's CONNACK.
+
+        Raises:
+            OSError: If the broker is unreachable or refuses the connection
+        """
+        self.close()
+        flags = 0x02  # clean session
+        payload = _string(self.client_id.encode())
+        if self.user is not None:
+            flags |= 0x80
+            payload += _string(self.user.encode())
+            if self.password is not None:
+                flags |= 0x40
+                payload += _string(self.password.encode())
+        variable = b"\x00\x04MQTT\x04" + bytes((flags, self.keepalive >> 8, self.keepalive & 0xFF))
+
+        sock = socket.socket()
+        sock.settimeout(self.SOCKET_TIMEOUT)
+        # Small QoS1 alerts must not wait behind Nagle-delayed readings
+        if hasattr(socket, "TCP_NODELAY"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            sock.connect(socket.getaddrinfo(self.host, self.port)[0][-1])
+            sock.sendall(bytes((CONNECT,)) + _remaining_length(len(variable) + len(payload))
+                         + variable + payload)
+            response = sock.recv(4)
+        except OSError:
+            sock.close()
+            raise
+        if len(response) != 4 or response[0] != CONNACK or response[3] != 0:
+            sock.close()
+            raise OSError(f"MQTT connection refused: {bytes(response)}")
+
+        self.sock = sock
+        self._poller = select.poll()
+        self._poller.register(sock, select.POLLIN)
+        self._rx = bytearray()
+        self.connected = True
+        self._last_send = ticks_ms()
+
+        # Resend whatever was in flight when the previous connection dropped
+        for packet_id in self.inflight:
+            if not self.connected:
+                break
+            self._resend(packet_id)
+        if not self.connected:
+            # _send() closed the connection
+            raise OSError("MQTT connection lost while resending")
+
+    def close(self):
+        """Close the connection, keeping unacknowledged alerts for a reconnect"""
+        if self.sock:
+            try:
+                if self.connected:
+                    self.sock.sendall(bytes((DISCONNECT, 0)))
+            except OSError:
+                pass
+            self.sock.close()
+        self.sock = None
+        self._poller = None
+        self.connected = False
+
+    def _send(self, data):
+        try:
+            self.sock.sendall(data)
+        except OSError as e:
+            print(f"MQTT send failed: {e}")
+            self.close()
+            return False
+        self._last_send = ticks_ms()
+        self.sent += 1
+        return True
+
+    ###############################################
+    # Publishing
+
+    def publish_reading(self, level):
+        """
+        Queue a reading for QoS0, replacing one poll() has not sent yet.
+
+        Args:
+            level: Sound level in dB (0-255)
+
+        Returns:
+            Whether the reading was queued; False while disconnected
+        """
+        if not self.connected:
+            return False
+        self._pending_level = max(0, min(255, int(level)))
+        return True
+
+    def publish_alert(self, body):
+        """
+        Queue an alert for QoS1.
+
+        Args:
+            body: Alert text
+
+        Returns:
+            Whether the alert was queued; False if too many are in flight
+        """
+        if len(self.inflight) + len(self._queued) >= self.max_inflight:
+            self.dropped += 1
+            return False
+
+        packet_id = self._next_id
+        self._next_id = packet_id % 0xFFFF + 1
+        payload = body.encode() if isinstance(body, str) else body
+        remaining = len(self._alert_topic) + 2 + len(payload)
+        packet = (bytearray((PUBLISH | _QOS1,)) + _remaining_length(remaining)
+                  + self._alert_topic + bytes((packet_id >> 8, packet_id & 0xFF)) + payload)
+        self._queued.append((packet_id, packet))
+        return True
+
+    def _send_reading(self, level):
+        digits = 1 if level < 10 else 2 if level < 100 else 3
+        end = self._reading_header_size + digits
+        pos = end
+        while pos > self._reading_header_size:
+            pos -= 1
+            self._reading[pos] = 48 + level % 10
+            level //= 10
+        self._reading[1] = end - 2
+        self._send(self._reading_views[digits])
+
+    def _resend(self, packet_id):
+        entry = self.inflight[packet_id]
+        entry[0][0] |= _DUP
+        entry[1] = ticks_ms()
+        self._send(entry[0])
+
+    ###############################################
+    # Incoming packets and housekeeping
+
+    def poll(self):
+        """
+        Send queued alerts and the latest reading, process incoming acks,
+        resend overdue alerts and keep the connection alive. Call from the
+        main loop only.
+        """
+        if not self.connected:
+            return
+        while self.connected and self._poller.poll(0):
+            try:
+                data = self.sock.recv(64)
+            except OSError as e:
+                print(f"MQTT receive failed: {e}")
+                self.close()
+                return
+            if not data:
+                print("MQTT connection closed by broker")
+                self.close()
+                return
+            self._rx += data
+            self._process_rx()
+
+        now = ticks_ms()
+        while self._queued and self.connected:
+            packet_id, packet = self._queued.pop(0)
+            self.inflight[packet_id] = [packet, now]
+            self._send(packet)
+        level = self._pending_level
+        if level is not None and self.connected:
+            self._pending_level = None
+            self._send_reading(level)
+
+        for packet_id in self.inflight:
+            if self.connected and ticks_diff(now, self.inflight[packet_id][1]) > self.retry_ms:
+                self._resend(packet_id)
+        if self.connected and ticks_diff(now, self._last_send) > self.keepalive * 500:
+            self._send(bytes((PINGREQ, 0)))
+
+    def _process_rx(self):
+        rx = self._rx
+        while len(rx) >= 2:
+            # Every packet the broker sends us has a single byte remaining length
+            size = 2 + rx[1]
+            if len(rx) < size:
+                return
+            if rx[0] & 0xF0 == PUBACK and size == 4:
+                if self.inflight.pop((rx[2] << 8) | rx[3], None) is not None:
+                    self.acked += 1
+            del rx[:size]
+
+
+###############################################
+# Main
+if __name__ == "__main__":
+    # Throughput and heap growth against a local broker stand-in. Each
+    # iteration queues like the sampling timer does, then polls like the
+    # main loop.
+    import threading
+    import tracemalloc
+
+    class BrokerStandIn(threading.Thread):
+        """Accepts one client, acks CONNECT, QoS1 PUBLISH and PINGREQ, counts messages"""
+
+        def __init__(self, port):
+            super().__init__(daemon=True)
+            self.server = socket.socket()
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server.bind(("127.0.0.1", port))
+            self.server.listen(1)
+            self.published = {0: 0, 1: 0}
+
+        def run(self):
+            conn, _ = self.server.accept()
+            buffer = b""
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    return
+                buffer += data
+                start = 0
+                while len(buffer) - start >= 2:
+                    length, shift, pos = 0, 0, start + 1
+                    while buffer[pos] & 0x80:
+                        length |= (buffer[pos] & 0x7F) << shift
+                        shift += 7
+                        pos += 1
+                    length |= buffer[pos] << shift
+                    end = pos + 1 + length
+                    if len(buffer) < end:
+                        break
+                    kind = buffer[start] & 0xF0
+                    if kind == CONNECT:
+                        conn.sendall(bytes((CONNACK, 2, 0, 0)))
+                    elif kind == PUBLISH:
+                        qos = (buffer[start] >> 1) & 0x03
+                        self.published[qos] += 1
+                        if qos:
+                            topic_end = pos + 1 + 2 + (buffer[pos + 1] << 8 | buffer[pos + 2])
+                            conn.sendall(bytes((PUBACK, 2)) + buffer[topic_end:topic_end + 2])
+                    elif kind == PINGREQ:
+                        conn.sendall(bytes((PINGRESP, 0)))
+                    elif kind == DISCONNECT:
+                        return
+                    start = end
+                buffer = buffer[start:]
+
+    def publisher_heap():
+        """Traced bytes, leaving out what the broker stand-in's thread holds"""
+        run = BrokerStandIn.run.__code__
+        last = max(line for _, _, line in run.co_lines() if line)
+        return sum(trace.size for trace in tracemalloc.take_snapshot().traces
+                   if not (trace.traceback[0].filename == run.co_filename
+                           and run.co_firstlineno <= trace.traceback[0].lineno <= last))
+
+    READINGS = 50_000
+    ALERT_EVERY = 100
+    broker = BrokerStandIn(18830)
+    broker.start()
+    publisher = MQTTPublisher("bench", "127.0.0.1", port=18830)
+    publisher.connect()
+
+    tracemalloc.start()
+    publisher.publish_reading(50)  # warm up
+    publisher.poll()
+    heap_before = publisher_heap()
+    start = ticks_ms()
+    for i in range(READINGS):
+        publisher.publish_reading(40 + i % 60)
+        if i % ALERT_EVERY == 0:
+            publisher.publish_alert(f"You are being too loud: {70 + i % 30}db")
+        publisher.poll()
+    while publisher.inflight and ticks_diff(ticks_ms(), start) < 60_000:
+        publisher.poll()
+    elapsed_ms = max(1, ticks_diff(ticks_ms(), start))
+    heap_after = publisher_heap()
+    tracemalloc.stop()
+    publisher.close()
+    broker.join(timeout=5)
+
+    alerts = READINGS // ALERT_EVERY
+    print(f"{READINGS} readings + {alerts} alerts in {elapsed_ms}ms "
+          f"({(READINGS + alerts) * 1000 / elapsed_ms:,.0f} msg/s)")
+    print(f"broker received {broker.published[0]} QoS0, {broker.published[1]} QoS1; "
+          f"acked {publisher.acked}, dropped {publisher.dropped}, in flight {len(publisher.inflight)}")
+    print(f"heap growth: {heap_after - heap_before} bytes")
@@ -0,0 +1,533 @@
+"""
+Swipeable UI pages, rendering only the page on screen
+"""
+from ticks import ticks_ms, ticks_us, ticks_diff, ticks_add
+from probe import Probe, STAGE_DRAW, STAGE_SHOW
+
+# Touch_CST816D gesture codes
+GESTURE_LEFT = 0x03
+GESTURE_RIGHT = 0x04
+
+# Shared no-op probe for pages that don't record timings
+_NO_PROBE = Probe(enabled=False)
+
+
+class Page:
+    """
+    One screen of the UI.
+
+    A page declares how often it wants to be redrawn (`refresh_ms`) and which
+    entries of the manager's data it shows (`needs`). "level" is always
+    provided with the latest sample; everything else comes from producers
+    registered on the PageManager. A page is only redrawn when it is due and
+    one of its needs changed since the last frame, or after enter().
+    """
+
+    def __init__(self, name, refresh_ms=1000, needs=()):
+        """
+        Initialize the page.
+
+        Args:
+            name: Short page name, used in benchmarks and logs
+            refresh_ms: Interval between redraws
+            needs: Names of the data entries the page shows
+        """
+        self.name = name
+        self.refresh_ms = refresh_ms
+        self.needs = tuple(needs)
+        self.probe = _NO_PROBE  # set by the PageManager
+        self.dirty = True
+        self.last_data = None
+
+    def enter(self):
+        """Called when the page becomes active, forces a full redraw"""
+        self.dirty = True
+
+    def draw(self, lcd, data):
+        """Draw the page into the framebuffer"""
+        raise NotImplementedError
+
+    def render(self, lcd, data):
+        """Draw the page and send the frame to the display"""
+        draw_start = self.probe.begin()
+        self.draw(lcd, data)
+        show_start = self.probe.begin()
+        lcd.show()
+        self.probe.end(STAGE_SHOW, show_start)
+        self.probe.end(STAGE_DRAW, draw_start)
+
+
+class _Producer:
+    """A named data source refreshed for the pages that need it"""
+
+    def __init__(self, name, function, idle_ms):
+        self.name = name
+        self.function = function
+        self.idle_ms = idle_ms
+        self.last = 0
+        self.runs = 0
+
+
+class PageManager:
+    """
+    Switches between pages and drives the active one.
+
+    Call update_decibel() once per sample (it has the same signature as
+    VolmeMeterUI.update_decibel, so process_sample can drive either). It runs
+    the producers the active page needs when the page is due, redraws it if
+    its data changed, and leaves the other pages alone. Producers no page on
+    screen needs only run every `idle_ms`, or not at all.
+
+    Gestures may arrive from another context than the sampling timer, so
+    swipe() only records the new page; the switch happens on the next update.
+
+    Redraws are scheduled from the previous due time rather than from when
+    the previous frame was drawn, and a page counts as due up to a quarter
+    of its refresh_ms early. The time a sample reaches the draw moves with
+    the I2C read, alerts and notifications before it; without the slack, a
+    sample arriving a millisecond earlier than the last one would skip its
+    frame.
+    """
+
+    def __init__(self, lcd, pages, probe=None):
+        """
+        Initialize the manager with the first page active.
+
+        Args:
+            lcd: LCD_1inch69 display object
+            pages: Pages in swipe order
+            probe: Optional Probe recording draw and show timings
+        """
+        self.lcd = lcd
+        self.pages = list(pages)
+        self.probe = probe or _NO_PROBE
+        for page in self.pages:
+            page.probe = self.probe
+        self.index = 0
+        self.data = {"level": None}
+        self.producers = []
+        self.frames = 0
+        self._pending = None
+        self._due = None  # ticks_ms() the active page is next due at
+
+    @property
+    def active(self):
+        return self.pages[self.index]
+
+    def add_producer(self, name, function, idle_ms=None):
+        """
+        Register a data source.
+
+        Args:
+            name: Data entry the result is stored under
+            function: Callable returning the current value
+            idle_ms: Refresh interval while no active page needs it, None to pause
+        """
+        self.producers.append(_Producer(name, function, idle_ms))
+
+    ###############################################
+    # Navigation
+
+    def swipe(self, gesture):
+        """
+        Handle a touch gesture. Left shows the next page, right the previous.
+
+        Returns:
+            Whether the gesture was a page swipe
+        """
+        if gesture == GESTURE_LEFT:
+            step = 1
+        elif gesture == GESTURE_RIGHT:
+            step = -1
+        else:
+            return False
+        current = self.index if self._pending is None else self._pending
+        self._pending = (current + step) % len(self.pages)
+        return True
+
+    def show_page(self, index):
+        """Make the page at index active on the next update"""
+        self._pending = index % len(self.pages)
+
+    def refresh(self):
+        """Redraw the active page on the next update even if its data is unchanged"""
+        self.active.dirty = True
+
+    ###############################################
+    # Rendering
+
+    def update_decibel(self, level, now=None):
+        """
+        Take a new sample and redraw the active page if it is due.
+
+        Args:
+            level: Sound level in dB, None for a missing sample
+            now: ticks_ms() timestamp, the current time by default
+
+        Returns:
+            Whether a frame was drawn
+        """
+        if now is None:
+            now = ticks_ms()
+        self.data["level"] = level
+
+        if self._pending is not None:
+            self.index = self._pending
+            self._pending = None
+            self.active.enter()
+
+        page = self.active
+        due = (page.dirty or self._due is None
+               or ticks_diff(now, self._due) >= -(page.refresh_ms // 4))
+        for producer in self.producers:
+            if producer.name in page.needs:
+                run = due
+            else:
+                run = (producer.idle_ms is not None
+                       and ticks_diff(now, producer.last) >= producer.idle_ms)
+            if run:
+                self.data[producer.name] = producer.function()
+                producer.last = now
+                producer.runs += 1
+        if not due:
+            return False
+
+        due_at = None if page.dirty else self._due
+        if due_at is not None:
+            due_at = ticks_add(due_at, page.refresh_ms)
+        if due_at is None or ticks_diff(due_at, now) <= 0:
+            # First frame, a page switch or more than a period behind: restart
+            # the schedule instead of catching up
+            due_at = ticks_add(now, page.refresh_ms)
+        self._due = due_at
+        data = tuple(self.data.get(name) for name in page.needs)
+        if not page.dirty and data == page.last_data:
+            return False
+        page.render(self.lcd, self.data)
+        page.dirty = False
+        page.last_data = data
+        self.frames += 1
+        return True
+
+
+###############################################
+# Pages
+
+class LivePage(Page):
+    """The volume meter, redrawn every sample"""
+
+    def __init__(self, ui, refresh_ms=500):
+        """
+        Args:
+            ui: VolmeMeterUI drawing the meter
+            refresh_ms: Redraw interval, normally the sampling period
+        """
+        super().__init__("live", refresh_ms, needs=("level",))
+        self.ui = ui
+
+    def enter(self):
+        # Other pages have drawn over the cached chrome
+        super().enter()
+        self.ui.invalidate()
+
+    def render(self, lcd, data):
+        # VolmeMeterUI times and shows its own frames
+        self.ui.update_decibel(data["level"])
+
+
+class _TextPage(Page):
+    """Title and rows of label/value pairs"""
+
+    TITLE_Y = 20
+    ROWS_Y = 70
+    ROW_HEIGHT = 28
+
+    def __init__(self, name, title, refresh_ms, needs):
+        super().__init__(name, refresh_ms, needs)
+        self.title = title
+
+    def rows(self, data):
+        """(label, value) pairs to show"""
+        raise NotImplementedError
+
+    def draw(self, lcd, data):
+        lcd.fill(lcd.white)
+        lcd.write_text(self.title, 25, self.TITLE_Y, 2, lcd.black)
+        y = self.ROWS_Y
+        for label, value in self.rows(data):
+            lcd.write_text(label, 20, y, 2, lcd.black)
+            lcd.write_text(value, 120, y, 2, lcd.blue)
+            y += self.ROW_HEIGHT
+
+
+class StatsPage(_TextPage):
+    """
+    Rolling statistics. Needs "stats": (last, min, max, mean, leq, missing),
+    see stats_snapshot().
+    """
+
+    def __init__(self, refresh_ms=1000):
+        super().__init__("stats", "Statistics", refresh_ms, needs=("stats",))
+
+    def rows(self, data):
+        last, low, high, mean, leq, missing = data["stats"]
+        return (("Now", "--" if last is None else f"{last} dB"),
+                ("Min", f"{low} dB"),
+                ("Max", f"{high} dB"),
+                ("Mean", f"{mean} dB"),
+                ("Leq", f"{leq} dB"),
+                ("Gaps", str(missing)))
+
+
+class StatusPage(_TextPage):
+    """Device and network status. Needs "status": sequence of (label, value)."""
+
+    def __init__(self, refresh_ms=2000):
+        super().__init__("status", "Status", refresh_ms, needs=("status",))
+
+    def rows(self, data):
+        return data["status"]
+
+
+class HistoryPage(Page):
+    """
+    Bar chart of the recent history, one column per time slot. Needs
+    "history": bytearray of column levels, see history_columns().
+    """
+
+    X = 20
+    Y = 60
+    HEIGHT = 180
+
+    def __init__(self, minutes=30, min_db=30, max_db=100, refresh_ms=5000):
+        """
+        Args:
+            minutes: Time span shown, for the axis label
+            min_db: Level at the bottom of the chart
+            max_db: Level at the top of the chart
+            refresh_ms: Redraw interval
+        """
+        super().__init__("history", refresh_ms, needs=("history",))
+        self.minutes = minutes
+        self.min_db = min_db
+        self.max_db = max_db
+
+    def draw(self, lcd, data):
+        lcd.fill(lcd.white)
+        lcd.write_text("History", 25, 20, 2, lcd.black)
+        bottom = self.Y + self.HEIGHT
+        lcd.hline(self.X, bottom, 200, lcd.black)
+        scale = self.HEIGHT / (self.max_db - self.min_db)
+        x = self.X
+        for level in data["history"]:
+            if level:
+                # Same colour bands as the live meter
+                color = lcd.green if level < 60 else lcd.yellow if level < 80 else lcd.red
+                height = int((min(level, self.max_db) - self.min_db) * scale)
+                if height > 0:
+                    lcd.vline(x, bottom - height, height, color)
+            x += 1
+        lcd.text(f"-{self.minutes}m", self.X, bottom + 6, lcd.black)
+        lcd.text("now", self.X + 200 - 24, bottom + 6, lcd.black)
+
+
+###############################################
+# Producers
+
+def stats_snapshot(stats):
+    """Producer for StatsPage from a RollingStats"""
+    return lambda: (stats.latest, stats.min, stats.max, round(stats.mean), round(stats.leq),
+                    stats.missing)
+
+
+def history_columns(history, samples, columns=200):
+    """
+    Producer for HistoryPage from a SampleHistory.
+
+    Args:
+        history: SampleHistory to read
+        samples: Number of most recent samples to show
+        columns: Chart width in pixels
+
+    Returns:
+        Callable returning a bytearray with the loudest level per column,
+        0 where every sample was missing
+    """
+    result = bytearray(columns)
+
+    def produce():
+        for i in range(columns):
+            result[i] = 0
+        start = history.next_index - samples
+        for index, level in enumerate(history.window(start)):
+            if level is not None:
+                column = (index + max(0, history.first_index - start)) * columns // samples
+                if level > result[column]:
+                    result[column] = level
+        # A copy, so the manager can tell whether the chart changed
+        return bytes(result)
+
+    return produce
+
+
+###############################################
+# Benchmark
+
+def benchmark_pages(manager, seconds=60, period_ms=500, baudrate=100_000_000, levels=None,
+                    jitter_ms=4):
+    """
+    Measure the CPU and SPI load each page puts on the sampling loop.
+
+    Every page is shown in turn for `seconds` of simulated time, fed one
+    sample per period as fast as possible. CPU load is the time spent in
+    update_decibel (producers, drawing and the blocking SPI write) over the
+    simulated time; SPI load is the time the bus needs for the frames sent.
+    Each sample reaches the pages up to `jitter_ms` late, like the work
+    before the draw in process_sample.
+
+    Run from the REPL on the device after building the pages like main.py:
+        >>> from pages import benchmark_pages
+        >>> benchmark_pages(manager)
+
+    Args:
+        manager: PageManager with its pages and producers
+        seconds: Simulated time per page
+        period_ms: Sampling period
+        baudrate: Display SPI clock in Hz
+        levels: Callable (sample number) -> level, a slow sawtooth by default
+        jitter_ms: Largest delay of a sample past its period
+
+    Returns:
+        Dict of page name to (CPU %, SPI %, frames, producer runs)
+    """
+    if levels is None:
+        levels = lambda n: 40 + (n // 4) % 50
+    frame_bytes = len(manager.lcd.buffer)
+    lcd_show = manager.lcd.show
+    shows = [0]
+
+    def counting_show():
+        shows[0] += 1
+        lcd_show()
+
+    manager.lcd.show = counting_show
+    samples = seconds * 1000 // period_ms
+    results = {}
+    try:
+        for index, page in enumerate(manager.pages):
+            manager.show_page(index)
+            shows[0] = 0
+            runs = sum(producer.runs for producer in manager.producers)
+            now = 0
+            for producer in manager.producers:
+                producer.last = now
+            busy_us = 0
+            for n in range(samples):
+                start = ticks_us()
+                # Deterministic spread over 0..jitter_ms
+                manager.update_decibel(levels(n), now + n * 7919 % (jitter_ms + 1))
+                busy_us += ticks_diff(ticks_us(), start)
+                now += period_ms
+            elapsed_us = samples * period_ms * 1000
+            spi_us = shows[0] * frame_bytes * 8 * 1_000_000 // baudrate
+            results[page.name] = (100 * busy_us / elapsed_us, 100 * spi_us / elapsed_us, shows[0],
+                                  sum(producer.runs for producer in manager.producers) - runs)
+            print(f"{page.name:>8}: CPU {results[page.name][0]:6.3f}%  SPI {results[page.name][1]:5.2f}%  "
+                  f"{shows[0]} frames, {results[page.name][3]} producer runs")
+    finally:
+        del manager.lcd.show
+    return results
+
+
+###############################################
+# Main
+if __name__ == "__main__":
+    # Host simulator run: the pages draw into a stand-in display that keeps
+    # the framebuffer size but only counts drawing calls, so CPU figures cover
+    # the page and producer logic rather than pixel pushing. Run
+    # benchmark_pages() on the device for absolute numbers.
+    import random
+    from history import SampleHistory
+    from stats import RollingStats
+
+    class SimulatedLCD:
+        width = 240
+        height = 280
+        red, green, blue, white, black, yellow = 0xF920, 0x07C0, 0x019F, 0xFFFF, 0x0000, 0xFFC0
+
+        def __init__(self):
+            self.buffer = bytearray(self.width * self.height * 2)
+            self.calls = 0
+
+        def _draw(self, *args):
+            self.calls += 1
+
+        fill = fill_rect = rect = hline = vline = text = write_text = _draw
+
+        def show(self):
+            pass
+
+    class SimulatedMeter:
+        """Stand-in for VolmeMeterUI (main.py needs the hardware modules)"""
+
+        def __init__(self, lcd):
+            self.lcd = lcd
+
+        def invalidate(self):
+            pass
+
+        def update_decibel(self, level):
+            self.lcd.fill_rect(21, 121, 2 * (level or 0), 28, self.lcd.green)
+            self.lcd.write_text("--" if level is None else str(level), 80, 180, 5, self.lcd.black)
+            self.lcd.show()
+
+    PERIOD_MS = 500
+    HISTORY_MINUTES = 30
+    lcd = SimulatedLCD()
+    stats = RollingStats()
+    history = SampleHistory()
+    rng = random.Random(35)
+    level = 50
+    for _ in range(HISTORY_MINUTES * 60 * 1000 // PERIOD_MS):
+        level = max(35, min(95, level + rng.randint(-2, 2)))
+        stats.add(level)
+        history.append(level)
+
+    manager = PageManager(lcd, (LivePage(SimulatedMeter(lcd), refresh_ms=PERIOD_MS),
+                                StatsPage(), HistoryPage(minutes=HISTORY_MINUTES), StatusPage()))
+    manager.add_producer("stats", stats_snapshot(stats), idle_ms=None)
+    manager.add_producer("history", history_columns(
+        history, HISTORY_MINUTES * 60 * 1000 // PERIOD_MS), idle_ms=None)
+    manager.add_producer("status", lambda: (("Uptime", "1h 02m"), ("Heap", "102 kB"),
+                                            ("I2C", "200 kHz"), ("MQTT", "up")), idle_ms=60_000)
+
+    def sample(n):
+        global level
+        level = max(35, min(95, level + rng.randint(-2, 2)))
+        stats.add(level)
+        history.append(level)
+        return level
+
+    results = benchmark_pages(manager, seconds=120, period_ms=PERIOD_MS, levels=sample)
+
+    # Swipes switch pages on the next sample and wrap around
+    manager.show_page(0)
+    manager.update_decibel(50)
+    assert manager.swipe(GESTURE_RIGHT) and not manager.swipe(0x0C)
+    manager.update_decibel(50)
+    assert manager.active.name == "status"
+    manager.swipe(GESTURE_LEFT)
+    manager.swipe(GESTURE_LEFT)
+    manager.update_decibel(50)
+    assert manager.active.name == "stats"
+    # Every changed sample is drawn on the live page, despite jittery
+    # processing before the draw and a slow notification delaying one sample
+    manager.show_page(0)
+    frames = manager.frames
+    now = 1_000_000
+    for n, delay in enumerate((3, 2, 4, 3, 300, 2, 4, 3, 1)):
+        manager.update_decibel(60 + n, now + n * PERIOD_MS + delay)
+    assert manager.frames - frames == 9, manager.frames - frames
+    live_spi = results["live"][1]
+    print(f"SPI load relative to the live page: "
+          + ", ".join(f"{name} {spi / live_spi:.0%}" for name, (_, spi, _, _) in results.items()))
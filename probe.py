@@ -0,0 +1,183 @@
+"""
+Low-overhead timing probe for the sampling hot path
+"""
+from array import array
+from ticks import ticks_us, ticks_diff
+
+# Pipeline stages
+STAGE_TICK = 0    # whole timer callback
+STAGE_I2C = 1     # DBMeter register read
+STAGE_ALERTS = 2  # AlertEngine.feed
+STAGE_DRAW = 3    # VolmeMeterUI.draw, including text and show
+STAGE_TEXT = 4    # one LCD write_text call
+STAGE_SHOW = 5    # SPI framebuffer transfer
+STAGE_NOTIFY = 6  # alert push request
+STAGE_JITTER = 7  # deviation of the tick interval from the sampling period
+STAGE_NAMES = ("tick", "i2c", "alerts", "draw", "text", "show", "notify", "jitter")
+
+
+def _begin_disabled():
+    return 0
+
+
+def _end_disabled(stage, start):
+    pass
+
+
+def _record_disabled(stage, elapsed_us):
+    pass
+
+
+class Probe:
+    """
+    Records stage durations into fixed-bucket latency histograms.
+
+    Usage:
+        start = probe.begin()
+        ...
+        probe.end(STAGE_I2C, start)
+
+    Bucket i counts spans shorter than 16 << i microseconds, the last bucket
+    catches everything longer. All storage is preallocated, so recording a
+    span never allocates. A disabled probe binds begin/end/record to no-op
+    functions at construction, leaving only the call itself on the hot path.
+    """
+
+    BUCKETS = 16
+    # Upper bound of the first bucket in microseconds
+    BUCKET_BASE_US = 16
+
+    def __init__(self, stages=STAGE_NAMES, enabled=True):
+        """
+        Initialize the probe.
+
+        Args:
+            stages: Names of the stages, indexed by the STAGE_* constants
+            enabled: Whether to record anything at all
+        """
+        self.stages = tuple(stages)
+        self.enabled = enabled
+        self.histograms = array('I', bytes(4 * self.BUCKETS * len(self.stages)))
+        self.counts = array('I', bytes(4 * len(self.stages)))
+        self.max_us = array('I', bytes(4 * len(self.stages)))
+        self.last_us = array('I', bytes(4 * len(self.stages)))
+        if not enabled:
+            self.begin = _begin_disabled
+            self.end = _end_disabled
+            self.record = _record_disabled
+
+    def begin(self):
+        """Start a span, returning the token to pass to end()."""
+        return ticks_us()
+
+    def end(self, stage, start):
+        """Close a span started with begin() and record it under stage."""
+        self.record(stage, ticks_diff(ticks_us(), start))
+
+    def record(self, stage, elapsed_us):
+        """Record an externally measured duration under stage."""
+        if elapsed_us < 0:
+            elapsed_us = 0
+        self.counts[stage] += 1
+        self.last_us[stage] = elapsed_us
+        if elapsed_us > self.max_us[stage]:
+            self.max_us[stage] = elapsed_us
+
+        bucket = 0
+        scaled = elapsed_us // self.BUCKET_BASE_US
+        while scaled and bucket < self.BUCKETS - 1:
+            scaled >>= 1
+            bucket += 1
+        self.histograms[stage * self.BUCKETS + bucket] += 1
+
+    def reset(self):
+        """Clear all recorded spans."""
+        for values in (self.histograms, self.counts, self.max_us, self.last_us):
+            for i in range(len(values)):
+                values[i] = 0
+
+    def percentile(self, stage, fraction):
+        """
+        Estimate a latency percentile from the histogram.
+
+        Args:
+            stage: Stage index
+            fraction: Percentile as a fraction, e.g. 0.99
+
+        Returns:
+            Upper bound in microseconds of the bucket holding the percentile,
+            capped at the largest recorded span; 0 if nothing was recorded
+        """
+        count = self.counts[stage]
+        if not count:
+            return 0
+        rank = fraction * count
+        seen = 0
+        offset = stage * self.BUCKETS
+        for bucket in range(self.BUCKETS):
+            seen += self.histograms[offset + bucket]
+            if seen >= rank:
+                return min(self.BUCKET_BASE_US << bucket, self.max_us[stage])
+        return self.max_us[stage]
+
+    def summary(self):
+        """
+        Compact one-line export, one `name:count/p50/p99/max` field per stage
+        that recorded anything, durations in microseconds.
+        """
+        fields = []
+        for stage, name in enumerate(self.stages):
+            if self.counts[stage]:
+                fields.append(f"{name}:{self.counts[stage]}/{self.percentile(stage, 0.5)}"
+                              f"/{self.percentile(stage, 0.99)}/{self.max_us[stage]}")
+        return " ".join(fields)
+
+    def report(self):
+        """Print a per-stage latency table."""
+        if not self.enabled:
+            print("Probe disabled")
+            return
+        print("stage      count     p50us     p99us     maxus    lastus")
+        for stage, name in enumerate(self.stages):
+            print("{:<8}{:>8}{:>10}{:>10}{:>10}{:>10}".format(
+                name, self.counts[stage], self.percentile(stage, 0.5),
+                self.percentile(stage, 0.99), self.max_us[stage], self.last_us[stage]))
+
+
+###############################################
+# Main
+if __name__ == "__main__":
+    # Overhead of an instrumented span against the bare loop
+    ITERATIONS = 200_000
+
+    def run(probe):
+        start = ticks_us()
+        if probe is None:
+            for _ in range(ITERATIONS):
+                pass
+        else:
+            for _ in range(ITERATIONS):
+                probe.end(STAGE_I2C, probe.begin())
+        return ticks_diff(ticks_us(), start)
+
+    baseline = run(None)
+    disabled = run(Probe(enabled=False))
+    enabled_probe = Probe()
+    enabled = run(enabled_probe)
+
+    for name, elapsed in (("disabled", disabled), ("enabled", enabled)):
+        overhead_ns = (elapsed - baseline) * 1000 / ITERATIONS
+        print(f"{name:>8}: {overhead_ns:6.0f} ns per span")
+    # The sampling path opens about 10 spans per 500 ms tick. Disabled, they
+    # must stay below 0.1% of the tick (50 us per span, ample for the Pico)
+    # and cost well under what recording does.
+    TICK_NS = 500e6
+    SPANS_PER_TICK = 10
+    disabled_ns = (disabled - baseline) * 1000 / ITERATIONS
+    enabled_ns = (enabled - baseline) * 1000 / ITERATIONS
+    share = disabled_ns * SPANS_PER_TICK / TICK_NS
+    print(f"disabled share of a 500 ms tick at {SPANS_PER_TICK} spans: {share:.6%}")
+    assert share < 0.001, f"disabled probe costs {share:.4%} of a tick"
+    assert disabled_ns < enabled_ns / 2, "disabled probe is not much cheaper than recording"
+    enabled_probe.report()
+    print(enabled_probe.summary())
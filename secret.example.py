@@ -2,3 +2,15 @@
 # AND REPLACE THE VALUES BELOW
 SSID_NAME = 'NETWORK_NAME'
 PASSWORD = 'PASSWORD'
+
+# Optional: MQTT broker for streaming readings and alerts
+# MQTT_HOST = 'broker.local'
+
+# Optional: NTP server for timestamps (pool.ntp.org by default)
+# NTP_HOST = 'pool.ntp.org'
+
+# Optional: local time offset from UTC in seconds for scheduled alerts (no DST)
+# UTC_OFFSET_S = 3600
+
+# Optional: collector ingest URL for timestamped sample batches
+# COLLECTOR_URL = 'http://collector.local:8000/ingest'
@@ -0,0 +1,211 @@
+"""
+Record and replay of raw sensor register reads
+
+A trace file is the MAGIC header followed by 4 byte records:
+    uint16 ms since the previous record (little endian, saturating)
+    uint8  register, with FAILED set if the read raised
+    uint8  value read (0 for failed reads)
+"""
+import struct
+import utime
+from dbmeter import DBMeter
+from ticks import ticks_ms, ticks_diff
+
+MAGIC = b"DBT1"
+RECORD_FORMAT = "<HBB"
+RECORD_SIZE = 4
+FAILED = 0x80  # register flag for a read that raised
+
+# Local hour scheduled alert rules see during a benchmark replay, so the
+# alert decisions for a trace don't depend on when it is replayed
+REPLAY_HOUR = 12
+
+
+class TraceRecorder:
+    """
+    Captures timestamped register reads from a running DBMeter.
+
+    Attach with `db_meter.recorder = TraceRecorder(path)`. Records are
+    buffered in a preallocated bytearray and written out when it fills up.
+    """
+
+    def __init__(self, path, buffer_records=128):
+        """
+        Initialize the recorder.
+
+        Args:
+            path: Trace file to create (overwritten if it exists)
+            buffer_records: Number of records buffered between file writes
+        """
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.records = 0
+        self._buffer = bytearray(RECORD_SIZE * buffer_records)
+        self._pos = 0
+        self._last = ticks_ms()
+
+    def record(self, reg, data):
+        """Record a successful read of consecutive registers starting at reg."""
+        for i in range(len(data)):
+            self._append(reg + i, data[i])
+
+    def record_failure(self, reg):
+        """Record a read of reg that raised."""
+        self._append(reg | FAILED, 0)
+
+    def _append(self, reg, value):
+        now = ticks_ms()
+        delta = max(0, min(0xFFFF, ticks_diff(now, self._last)))
+        self._last = now
+        struct.pack_into(RECORD_FORMAT, self._buffer, self._pos, delta, reg, value)
+        self._pos += RECORD_SIZE
+        self.records += 1
+        if self._pos == len(self._buffer):
+            self.flush()
+
+    def flush(self):
+        """Write buffered records to the file."""
+        if self._pos:
+            self.file.write(memoryview(self._buffer)[:self._pos])
+            self._pos = 0
+
+    def close(self):
+        """Flush and close the trace file."""
+        self.flush()
+        self.file.close()
+
+
+def read_trace(path, chunk_records=128):
+    """
+    Iterate over the records of a trace file.
+
+    Args:
+        path: Trace file written by TraceRecorder
+        chunk_records: Number of records read from the file at once
+
+    Yields:
+        (delta_ms, register, value, ok) per record
+    """
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a sensor trace")
+        chunk = bytearray(RECORD_SIZE * chunk_records)
+        while True:
+            size = file.readinto(chunk)
+            if not size:
+                return
+            for offset in range(0, size - size % RECORD_SIZE, RECORD_SIZE):
+                delta, reg, value = struct.unpack_from(RECORD_FORMAT, chunk, offset)
+                yield delta, reg & ~FAILED, value, not (reg & FAILED)
+
+
+class ReplayDBMeter(DBMeter):
+    """
+    DBMeter that reads its registers from a recorded trace instead of I2C.
+
+    Everything above reg_read (current_decibel, alerting, UI) runs unchanged.
+    Notifications are collected in `alerts` instead of being sent.
+    """
+
+    def __init__(self, path, realtime=False):
+        """
+        Initialize the replay meter.
+
+        Args:
+            path: Trace file written by TraceRecorder
+            realtime: Sleep for the recorded gaps between reads, otherwise
+                replay as fast as possible
+        """
+        # No I2C bus: reads come from the trace
+        self.recorder = None
+        self.realtime = realtime
+        self.alerts = []
+        self._decibel_value = 0
+        self._records = read_trace(path)
+        self._pending = next(self._records, None)
+
+    @property
+    def exhausted(self):
+        """Whether every record of the trace has been replayed"""
+        return self._pending is None
+
+    def reg_read(self, addr, reg, nbytes=1):
+        """
+        Replay the next recorded read of the requested register(s), skipping
+        records of other registers. Recorded failures are raised again.
+        """
+        if nbytes < 1:
+            return bytearray()
+
+        data = bytearray(nbytes)
+        for i in range(nbytes):
+            while self._pending is not None:
+                delta, recorded_reg, value, ok = self._pending
+                self._pending = next(self._records, None)
+                if self.realtime and delta:
+                    utime.sleep_ms(delta)
+                if recorded_reg == reg + i:
+                    break
+            else:
+                raise EOFError("End of sensor trace")
+            if not ok:
+                raise OSError(5, "Replayed I2C failure")  # EIO
+            data[i] = value
+        return data
+
+    def notify(self, body=None, title=None, check_cooldown=True):
+        """Collect the alert decision instead of pushing it"""
+        self.alerts.append((title or "Noise Alert", body))
+
+
+def benchmark(path, realtime=False, vm_ui=None, rules=None, clock=None):
+    """
+    Feed a trace through the sampling pipeline and report throughput and alerts.
+
+    Samples go through process_sample with the same alert engine, rolling
+    statistics and history main.py uses, so the replay runs that code too.
+
+    Args:
+        path: Trace file written by TraceRecorder
+        realtime: Replay at the recorded pace instead of as fast as possible
+        vm_ui: Optional VolmeMeterUI to render every sample to
+        rules: Alert rules, main.ALERT_RULES by default
+        clock: Local hour source for scheduled rules, REPLAY_HOUR by default
+
+    Returns:
+        (samples, samples per second, alerts) where alerts is a list of
+        (title, body)
+    """
+    from alerts import AlertEngine
+    from history import SampleHistory
+    from stats import RollingStats
+    from main import ALERT_RULES, SAMPLE_PERIOD_MS, HISTORY_HOURS, process_sample
+
+    meter = ReplayDBMeter(path, realtime=realtime)
+    engine = AlertEngine(rules or ALERT_RULES, period_ms=SAMPLE_PERIOD_MS,
+                         clock=clock or (lambda: REPLAY_HOUR))
+    stats = RollingStats()
+    history = SampleHistory(capacity=HISTORY_HOURS * 3600 * 1000 // SAMPLE_PERIOD_MS)
+    samples = 0
+    start = ticks_ms()
+    while not meter.exhausted:
+        process_sample(meter, engine, vm_ui, stats=stats, history=history)
+        samples += 1
+    elapsed_ms = max(1, ticks_diff(ticks_ms(), start))
+
+    rate = samples * 1000 / elapsed_ms
+    print(f"Replayed {samples} samples in {elapsed_ms}ms ({rate:.0f} samples/s)")
+    print(f"Last {stats.window} samples: Leq {stats.leq:.1f} dB, min {stats.min}, "
+          f"max {stats.max}; {stats.missing} missing, history {len(history)} samples "
+          f"in {history.nbytes} bytes")
+    for title, body in meter.alerts:
+        print(f"  {title}: {body}")
+    print(f"{len(meter.alerts)} alerts")
+    return samples, rate, meter.alerts
+
+
+###############################################
+# Main
+if __name__ == "__main__":
+    from main import TRACE_PATH
+    benchmark(TRACE_PATH)
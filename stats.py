@@ -0,0 +1,135 @@
+"""
+Rolling statistics over the most recent samples
+"""
+import math
+from array import array
+
+# Sound energy lookup for integer dB readings, so a sample never needs pow()
+_ENERGY = array('f', [10 ** (level / 10 - 6) for level in range(256)])
+
+
+def energy(level):
+    """Relative sound energy of a dB level (scaled by 1e-6 to stay in float range)."""
+    if isinstance(level, int) and 0 <= level < 256:
+        return _ENERGY[level]
+    return 10 ** (level / 10 - 6)
+
+
+class EnergyWindow:
+    """
+    Running sound energy sum over the last `size` samples, for Leq.
+
+    add() is O(1): the sum is updated incrementally and recomputed once per
+    window to cancel float drift.
+    """
+
+    def __init__(self, size):
+        """
+        Initialize the window.
+
+        Args:
+            size: Number of samples averaged over
+        """
+        self.size = size
+        self.energies = array('f', bytes(4 * size))
+        self.filled = 0
+        self._pos = 0
+        self._sum = 0.0
+
+    def add(self, level):
+        """
+        Add a sample.
+
+        Args:
+            level: Sound level in dB
+        """
+        value = energy(level)
+        self._sum += value - self.energies[self._pos]
+        self.energies[self._pos] = value
+        self._pos += 1
+        if self._pos == self.size:
+            self._pos = 0
+            self._sum = sum(self.energies)
+        if self.filled < self.size:
+            self.filled += 1
+
+    @property
+    def leq(self):
+        """Equivalent continuous level over the samples added so far, up to size"""
+        if not self.filled or self._sum <= 0:
+            return 0.0
+        return 10 * math.log10(self._sum / self.filled) + 60
+
+
+class RollingStats:
+    """
+    Keeps the last `window` samples and their running sums.
+
+    add() is O(1). min/max scan the window, so they are meant for
+    occasional readers (display, metrics scrapes), not for every sample.
+    """
+
+    def __init__(self, window=120):
+        """
+        Initialize the statistics.
+
+        Args:
+            window: Number of samples kept (120 = 60 s at the 500 ms period)
+        """
+        self.window = window
+        self.samples = array('B', bytes(window))
+        self.energy = EnergyWindow(window)
+        self.last = None    # last valid sample
+        self.latest = None  # most recent sample, None if it was missing
+        self.count = 0      # samples added since start
+        self.missing = 0    # missing samples since start
+        self._pos = 0
+        self._filled = 0
+        self._sum = 0
+
+    def add(self, level):
+        """
+        Add a sample.
+
+        Args:
+            level: Sound level in dB, or None for a missing sample
+        """
+        if level is None:
+            self.missing += 1
+            self.latest = None
+            return
+        level = max(0, min(255, int(level)))
+        self.latest = level
+        self.energy.add(level)
+
+        self._sum += level - self.samples[self._pos]
+        self.samples[self._pos] = level
+        self._pos += 1
+        if self._pos == self.window:
+            self._pos = 0
+        if self._filled < self.window:
+            self._filled += 1
+        self.last = level
+        self.count += 1
+
+    def _values(self):
+        if self._filled < self.window:
+            return self.samples[:self._filled]
+        return self.samples
+
+    @property
+    def min(self):
+        return min(self._values()) if self._filled else 0
+
+    @property
+    def max(self):
+        return max(self._values()) if self._filled else 0
+
+    @property
+    def mean(self):
+        return self._sum / self._filled if self._filled else 0.0
+
+    @property
+    def leq(self):
+        """Equivalent continuous level (energy average) over the window"""
+        return self.energy.leq
@@ -0,0 +1,30 @@
+"""
+Tick counter helpers that also work off-device
+
+On MicroPython these are the native time.ticks_* functions. On CPython (host
+tools and the simulator) they are emulated with the same wraparound period,
+so code using ticks_diff/ticks_add behaves identically on both.
+"""
+
+try:
+    from time import ticks_ms, ticks_us, ticks_diff, ticks_add
+except ImportError:
+    import time as _time
+
+    # MicroPython's ticks wrap at 2**30 on all ports
+    TICKS_PERIOD = 1 << 30
+    _TICKS_MAX = TICKS_PERIOD - 1
+    _TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+    def ticks_ms():
+        return (_time.monotonic_ns() // 1_000_000) & _TICKS_MAX
+
+    def ticks_us():
+        return (_time.monotonic_ns() // 1_000) & _TICKS_MAX
+
+    def ticks_add(ticks, delta):
+        return (ticks + delta) & _TICKS_MAX
+
+    def ticks_diff(ticks1, ticks2):
+        diff = (ticks1 - ticks2) & _TICKS_MAX
+        return diff - TICKS_PERIOD if diff >= _TICKS_HALFPERIOD else diff
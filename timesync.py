@@ -0,0 +1,468 @@
+"""
+Wall-clock time from NTP, mapped onto the tick counter
+"""
+import socket
+import struct
+from array import array
+from ticks import ticks_ms, ticks_diff, ticks_add
+
+# Seconds from the NTP era (1900) to the Unix epoch (1970)
+NTP_DELTA = 2208988800
+
+# Move the mapping's anchor forward before ticks_diff against it could
+# overflow (ticks wrap at 2**30 ms, differences are valid up to 2**29 ms)
+_REANCHOR_MS = 1 << 28
+
+
+def _ntp_ms(data, offset):
+    """NTP timestamp at data[offset:offset + 8] as Unix epoch milliseconds"""
+    seconds, fraction = struct.unpack_from("!II", data, offset)
+    return (seconds - NTP_DELTA) * 1000 + ((fraction * 1000 + (1 << 31)) >> 32)
+
+
+class TimeService:
+    """
+    Maps tick counter values to Unix epoch milliseconds.
+
+    sync() asks an NTP server for the time and anchors the mapping at the
+    tick the reply arrived, half a round trip after the server sent it.
+    Between syncs, epoch_ms() extrapolates from that anchor, corrected by
+    the measured drift of the tick counter against the server. The drift
+    estimate is refined on every sync at least `min_drift_ms` after the
+    previous one.
+
+    poll() also refreshes `hour`, the local hour at a fixed UTC offset, so
+    code running in timer callbacks can read the time of day from a plain
+    attribute instead of touching the mapping while the main loop syncs.
+
+    Epoch values are kept as integer milliseconds; only the drift correction
+    is a float, so single-precision floats don't cost accuracy. The anchor
+    is moved forward every few days, so a mapping used without resyncing
+    survives the ticks wraparound.
+    """
+
+    def __init__(self, host="pool.ntp.org", port=123, timeout=1, resync_ms=3_600_000,
+                 retry_ms=60_000, min_drift_ms=600_000, clock=ticks_ms, utc_offset_s=0):
+        """
+        Initialize the service. Call sync() or poll() to get the time.
+
+        Args:
+            host: NTP server host name or address
+            port: NTP server port
+            timeout: Seconds to wait for a reply
+            resync_ms: Interval between syncs done by poll()
+            retry_ms: Interval between poll() attempts after a failed sync
+            min_drift_ms: Shortest interval between syncs used for a drift estimate
+            clock: Tick source in milliseconds, ticks_ms by default
+            utc_offset_s: Local time offset from UTC in seconds, used for `hour`
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.resync_ms = resync_ms
+        self.retry_ms = retry_ms
+        self.min_drift_ms = min_drift_ms
+        self.clock = clock
+        self.utc_offset_s = utc_offset_s
+
+        self.hour = None           # local hour as of the last poll(), None until synced
+        self.synced = False
+        self.syncs = 0
+        self.drift_ppm = 0.0       # tick counter rate error, positive if it runs slow
+        self.last_error_ms = 0     # server time minus our estimate at the last sync
+        self.last_rtt_ms = 0
+        self._base_tick = 0
+        self._base_epoch = 0
+        self._sync_epoch = 0       # server time at the drift reference sync
+        self._since_sync = 0       # ticks between the drift reference and the anchor
+        self._drift_samples = 0
+        self._attempt_tick = None  # tick of the last poll() attempt
+        self._attempt_ok = False
+
+    ###############################################
+    # Mapping
+
+    def _reanchor(self, now):
+        elapsed = ticks_diff(now, self._base_tick)
+        if elapsed > _REANCHOR_MS:
+            self._base_epoch += elapsed + int(elapsed * self.drift_ppm / 1_000_000)
+            self._base_tick = now
+            self._since_sync += elapsed
+
+    def epoch_ms(self, tick=None):
+        """
+        Wall-clock time of a tick.
+
+        Args:
+            tick: ticks_ms() value, now by default. Must be within a few days
+                of the current time.
+
+        Returns:
+            Unix epoch milliseconds, None before the first sync
+        """
+        if not self.synced:
+            return None
+        now = self.clock()
+        self._reanchor(now)
+        if tick is None:
+            tick = now
+        elapsed = ticks_diff(tick, self._base_tick)
+        return self._base_epoch + elapsed + int(elapsed * self.drift_ppm / 1_000_000)
+
+    def elapsed_ms(self, ticks):
+        """A tick difference converted to wall-clock milliseconds"""
+        return ticks + int(ticks * self.drift_ppm / 1_000_000)
+
+    ###############################################
+    # Syncing
+
+    def _exchange(self):
+        """
+        One NTP request.
+
+        Returns:
+            (tick the reply arrived, server epoch ms at that tick, round trip ms)
+        """
+        request = bytearray(48)
+        request[0] = 0x23  # version 4, client mode
+        # Echoed back as the originate timestamp, to match the reply
+        struct.pack_into("!I", request, 44, self.clock())
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.settimeout(self.timeout)
+            address = socket.getaddrinfo(self.host, self.port)[0][-1]
+            sent = self.clock()
+            sock.sendto(request, address)
+            while True:
+                reply = sock.recv(48)
+                received = self.clock()
+                if len(reply) == 48 and reply[24:32] == request[40:48]:
+                    break
+        finally:
+            sock.close()
+
+        if reply[0] & 0x07 != 4 or reply[1] == 0:
+            # Not a server reply, or a kiss-of-death
+            raise OSError(f"Bad NTP reply: mode {reply[0] & 0x07}, stratum {reply[1]}")
+        server_received = _ntp_ms(reply, 32)
+        server_sent = _ntp_ms(reply, 40)
+        rtt = max(0, ticks_diff(received, sent) - (server_sent - server_received))
+        return received, server_sent + rtt // 2, rtt
+
+    def sync(self):
+        """
+        Sync with the NTP server, updating the offset and drift estimate.
+
+        Raises:
+            OSError: If the server doesn't answer in time or sends a bad reply
+        """
+        tick, epoch, rtt = self._exchange()
+        # Ticks since the drift reference sync
+        elapsed = 0
+        if self.synced:
+            self._reanchor(tick)
+            self.last_error_ms = epoch - self.epoch_ms(tick)
+            elapsed = self._since_sync + ticks_diff(tick, self._base_tick)
+
+        if not self.synced or elapsed >= self.min_drift_ms:
+            if elapsed:
+                # Drift over the interval, relative to the uncorrected ticks
+                measured = ((epoch - self._sync_epoch) - elapsed) * 1_000_000 / elapsed
+                if self._drift_samples:
+                    self.drift_ppm += (measured - self.drift_ppm) / 4
+                else:
+                    self.drift_ppm = measured
+                self._drift_samples += 1
+            self._sync_epoch = epoch
+            self._since_sync = 0
+        else:
+            # Too soon for a drift estimate, keep the older reference
+            self._since_sync = elapsed
+        self._base_tick = tick
+        self._base_epoch = epoch
+        self.last_rtt_ms = rtt
+        self.synced = True
+        self.syncs += 1
+
+    def poll(self):
+        """
+        Sync when resync_ms has passed since the last successful attempt, or
+        retry_ms since a failed one, keep the mapping anchored across
+        wraparounds and refresh `hour`. Call regularly; failures are
+        printed, not raised.
+
+        Returns:
+            Whether a sync was attempted
+        """
+        now = self.clock()
+        if self.synced:
+            self._reanchor(now)
+        attempt = True
+        if self._attempt_tick is not None:
+            interval = self.resync_ms if self._attempt_ok else self.retry_ms
+            attempt = ticks_diff(now, self._attempt_tick) >= interval
+        if attempt:
+            self._attempt_tick = now
+            try:
+                self.sync()
+                self._attempt_ok = True
+            except OSError as e:
+                print(f"NTP sync failed: {e}")
+                self._attempt_ok = False
+        if self.synced:
+            self.hour = (self.epoch_ms() // 1000 + self.utc_offset_s) // 3600 % 24
+        return attempt
+
+
+class SampleBatch:
+    """
+    Samples waiting for upload, stamped with ticks instead of wall-clock time.
+
+    Each sample costs one tick read and two array writes. payload() turns
+    the batch into the collector's ingest format: one base epoch from the
+    TimeService and per-sample offsets from the tick deltas.
+
+    add() runs in the sampling timer callback while payload() and discard()
+    run in the main loop, so only add() moves samples: discard() records a
+    count that the next add() drops before storing its sample.
+    """
+
+    def __init__(self, capacity=240):
+        """
+        Initialize the batch.
+
+        Args:
+            capacity: Most samples held (240 = 2 min at 500 ms)
+        """
+        self.capacity = capacity
+        self.offsets = array('I', bytes(4 * capacity))
+        self.levels = bytearray(capacity)
+        self.count = 0
+        self.dropped = 0
+        self._first = 0
+        self._pending_discard = 0
+
+    def __len__(self):
+        return self.count - self._pending_discard
+
+    def _apply_discard(self):
+        count = self._pending_discard
+        if count >= self.count:
+            self.count = 0
+        elif count:
+            shift = self.offsets[count]
+            for i in range(count, self.count):
+                self.offsets[i - count] = self.offsets[i] - shift
+                self.levels[i - count] = self.levels[i]
+            self._first = ticks_add(self._first, shift)
+            self.count -= count
+        self._pending_discard = 0
+
+    def add(self, level, tick=None):
+        """
+        Add a sample, first dropping any samples discard() asked for.
+
+        Args:
+            level: Sound level in dB (0-255); None for a missing sample,
+                which is left out
+            tick: ticks_ms() of the reading, now by default
+
+        Returns:
+            Whether the sample was stored; False if missing or the batch is full
+        """
+        if self._pending_discard:
+            self._apply_discard()
+        if level is None:
+            return False
+        if self.count == self.capacity:
+            self.dropped += 1
+            return False
+        if tick is None:
+            tick = ticks_ms()
+        if not self.count:
+            self._first = tick
+        self.offsets[self.count] = ticks_diff(tick, self._first)
+        self.levels[self.count] = max(0, min(255, int(level)))
+        self.count += 1
+        return True
+
+    def payload(self, time_service, device, room=None):
+        """
+        The batch as a collector ingest dict.
+
+        Args:
+            time_service: Synced TimeService
+            device: Device name
+            room: Optional room name
+
+        Returns:
+            {"device", "room", "base_ms", "offsets_ms", "db"}, None if the
+            batch is empty, the time is unknown or an earlier discard() has
+            not been applied yet
+        """
+        if self._pending_discard or not time_service.synced:
+            return None
+        # Samples added from here on land past count and are left for later
+        count = self.count
+        if not count:
+            return None
+        batch = {
+            "device": device,
+            "base_ms": time_service.epoch_ms(self._first),
+            "offsets_ms": [time_service.elapsed_ms(self.offsets[i]) for i in range(count)],
+            "db": list(self.levels[:count]),
+        }
+        if room is not None:
+            batch["room"] = room
+        return batch
+
+    def discard(self, count=None):
+        """
+        Drop the oldest samples, e.g. those of an uploaded payload, keeping
+        any added since. Takes effect on the next add().
+
+        Args:
+            count: Number of samples to drop, all by default
+        """
+        self._pending_discard = self.count if count is None else min(count, self.count)
+
+
+###############################################
+# Main
+if __name__ == "__main__":
+    # Drift and wraparound test against a local NTP stand-in. A simulated
+    # tick counter runs 80 ppm slow and wraps every 2**30 ms; the stand-in
+    # answers with the true simulated time.
+    import threading
+    import time
+    from ticks import TICKS_PERIOD
+
+    class SimulatedClock:
+        """True time plus a drifting, wrapping tick counter derived from it"""
+
+        def __init__(self, start_epoch_ms, start_tick, drift_ppm):
+            self.start_epoch_ms = start_epoch_ms
+            self.start_tick = start_tick
+            self.drift_ppm = drift_ppm
+            self.true_ms = 0   # simulated time since start
+            self.latency_ms = 0
+
+        def epoch_ms(self):
+            return self.start_epoch_ms + self.true_ms
+
+        def ticks_ms(self):
+            ticks = self.true_ms * (1 - self.drift_ppm / 1_000_000)
+            return int(self.start_tick + ticks) % TICKS_PERIOD
+
+        def advance(self, ms):
+            self.true_ms += ms
+
+    class NTPStandIn(threading.Thread):
+        """Answers NTP requests with the simulated clock's true time"""
+
+        def __init__(self, clock, port):
+            super().__init__(daemon=True)
+            self.clock = clock
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.bind(("127.0.0.1", port))
+
+        def run(self):
+            while True:
+                request, address = self.sock.recvfrom(48)
+                # The request takes latency_ms to arrive, the reply as long again
+                self.clock.advance(self.clock.latency_ms)
+                ms = self.clock.epoch_ms()
+                seconds, fraction = divmod(ms, 1000)
+                stamp = struct.pack("!II", seconds + NTP_DELTA, (fraction << 32) // 1000)
+                reply = bytearray(48)
+                reply[0] = 0x24  # version 4, server mode
+                reply[1] = 2     # stratum
+                reply[24:32] = request[40:48]
+                reply[32:40] = stamp
+                reply[40:48] = stamp
+                self.clock.advance(self.clock.latency_ms)
+                self.sock.sendto(reply, address)
+
+    PORT = 12300
+    DRIFT_PPM = 80
+    DAY_MS = 86_400_000
+    # Start the tick counter an hour before it wraps
+    sim = SimulatedClock(1_760_000_000_000, TICKS_PERIOD - 3_600_000, DRIFT_PPM)
+    sim.latency_ms = 15
+    NTPStandIn(sim, PORT).start()
+    service = TimeService("127.0.0.1", PORT, resync_ms=3_600_000, clock=sim.ticks_ms,
+                          utc_offset_s=2 * 3600)
+    assert service.hour is None
+
+    service.poll()
+    assert service.hour == (sim.epoch_ms() // 3_600_000 + 2) % 24
+    print(f"first sync: error {service.epoch_ms() - sim.epoch_ms()}ms, rtt {service.last_rtt_ms}ms")
+    assert abs(service.epoch_ms() - sim.epoch_ms()) <= 2
+
+    # A day of hourly syncs across the wraparound; check the estimate just
+    # before each sync, when the extrapolation is oldest. The first hour has
+    # no drift estimate yet.
+    errors = []
+    for hour in range(24):
+        for _ in range(60):
+            sim.advance(60_000)
+            service.poll()
+        errors.append(abs(service.epoch_ms() - sim.epoch_ms()))
+    worst_ms = max(errors[1:])
+    print(f"after {service.syncs} syncs: drift {service.drift_ppm:.1f} ppm (true {DRIFT_PPM}), "
+          f"error before a resync {errors[0]}ms in the first hour, then at most {worst_ms}ms")
+    assert abs(service.drift_ppm - DRIFT_PPM) < 2 and worst_ms <= 3
+
+    # Without drift correction the same hour would be off by DRIFT_PPM * 3.6 ms
+    uncorrected = TimeService("127.0.0.1", PORT, clock=sim.ticks_ms)
+    uncorrected.sync()
+    sim.advance(3_600_000)
+    print(f"one hour uncorrected: error {abs(uncorrected.epoch_ms() - sim.epoch_ms())}ms, "
+          f"corrected: {abs(service.epoch_ms() - sim.epoch_ms())}ms")
+
+    # A week without a sync (NTP unreachable): longer than ticks_diff can
+    # span, so this only works because poll() moves the anchor forward
+    service.resync_ms = 30 * DAY_MS
+    for _ in range(7 * 24 * 60):
+        sim.advance(60_000)
+        service.poll()
+    offline_ms = abs(service.epoch_ms() - sim.epoch_ms())
+    print(f"7 days offline: error {offline_ms}ms")
+    assert offline_ms <= 1000
+
+    # A batch spanning the tick wraparound keeps monotonic offsets
+    service.resync_ms = 3_600_000
+    while not 0 < ticks_diff(0, sim.ticks_ms()) <= 50_000:
+        sim.advance(10_000)
+        service.poll()
+    batch = SampleBatch()
+    truth = []
+    first_tick = sim.ticks_ms()
+    for i in range(120):
+        batch.add(50 + i % 7, sim.ticks_ms())
+        truth.append(sim.epoch_ms())
+        sim.advance(500)
+    assert sim.ticks_ms() < first_tick, "batch should span the wraparound"
+    payload = batch.payload(service, "bench")
+    stamps = [payload["base_ms"] + offset for offset in payload["offsets_ms"]]
+    assert stamps == sorted(stamps) and payload["offsets_ms"][0] == 0
+    batch_error = max(abs(stamp - true) for stamp, true in zip(stamps, truth))
+    print(f"batch of {len(batch)} across the wraparound: worst timestamp error {batch_error}ms")
+    assert batch_error <= 400
+
+    # Discarding an uploaded payload keeps the samples added after it. The
+    # discard waits for the next add(), as it would for the sampling timer.
+    batch.discard(100)
+    assert len(batch) == 20 and batch.payload(service, "bench") is None
+    batch.add(None)
+    rest = batch.payload(service, "bench")
+    assert rest["base_ms"] + rest["offsets_ms"][-1] == stamps[-1] and rest["db"] == payload["db"][100:]
+
+    # Per-sample cost of stamping
+    SAMPLES = 100_000
+    batch = SampleBatch(capacity=SAMPLES)
+    start = time.perf_counter()
+    for i in range(SAMPLES):
+        batch.add(50)
+    print(f"add(): {(time.perf_counter() - start) / SAMPLES * 1e6:.2f}us per sample")